@@ -0,0 +1,137 @@
+import pygame, time, asyncio
+
+import telemetry
+from async_runner import end_frame
+
+"""This module slows the game's frame rate right down while nothing is
+happening on screen, so idle screens don't spend power redrawing
+identical frames.
+
+Screens tick the clock as usual, telling it whether anything on screen
+is still animating. Once there has been no input and no animation for a
+moment, each frame blocks waiting for input instead of sleeping, so the
+first event wakes the game straight back up to full speed.
+"""
+
+# Frame length while idle. Idle frames land on multiples of this, so
+# anything blinking in step with it still changes on time.
+IDLE_FRAME_MS = 250
+
+# Stay at full speed this long after the last input or animation.
+IDLE_AFTER_MS = 1000
+
+# Length of one half of a blink, on or off.
+BLINK_MS = 500
+
+# The real event queue, the session recorder may replace pygame.event.get.
+_event_get = pygame.event.get
+
+
+def blink_on():
+    """True during the visible half of a blink.
+    """
+    return (pygame.time.get_ticks() // BLINK_MS) % 2 == 1
+
+
+class AdaptiveClock(object):
+    """Wraps a pygame Clock, ticking at the requested frame rate while
+    the game is active and at IDLE_FRAME_MS while it's idle.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.last_active = 0
+        self.mouse = None
+        self.frame_started = time.perf_counter()
+        self.frame_ended = self.frame_started
+
+        # Functions called at the end of every frame, each returning True
+        # while it's animating something, like a music fade.
+        self.frame_hooks = []
+
+    def run_frame_hooks(self):
+        return any([hook() for hook in self.frame_hooks])
+
+    def input_seen(self):
+        """True if the mouse has moved or is held down since last frame.
+        """
+        mouse = pygame.mouse.get_pos()
+        moved = mouse != self.mouse
+        self.mouse = mouse
+        return moved or any(pygame.mouse.get_pressed())
+
+    def wait_for_input(self, timeout):
+        """Blocks for up to 'timeout' ms until an event arrives, and
+        leaves it in the queue for the screen to handle.
+        """
+        event = pygame.event.wait(timeout)
+        if event.type == pygame.NOEVENT:
+            return False
+
+        # Put it back in front of anything that arrived after it.
+        for queued in [event] + _event_get():
+            pygame.event.post(queued)
+        return True
+
+    def tick(self, framerate=0, busy=False):
+        """Ends a frame. 'busy' says something on screen is animating and
+        needs the full frame rate.
+        """
+        telemetry.frame((time.perf_counter() - self.frame_started) * 1000)
+        busy = self.run_frame_hooks() or busy
+        try:
+            return self.wait(framerate, busy)
+        finally:
+            self.frame_started = time.perf_counter()
+
+    def wait(self, framerate, busy):
+        now = pygame.time.get_ticks()
+        if busy or self.input_seen():
+            self.last_active = now
+
+        if not framerate or now - self.last_active < IDLE_AFTER_MS:
+            return self.clock.tick(framerate)
+
+        if self.wait_for_input(IDLE_FRAME_MS - now % IDLE_FRAME_MS):
+            self.last_active = pygame.time.get_ticks()
+        return self.clock.tick()
+
+    async def tick_async(self, framerate=0, busy=False):
+        """Ends a frame of a screen running on the event loop. Background
+        tasks get to run, then the rest of the frame is waited out.
+        """
+        telemetry.frame((time.perf_counter() - self.frame_started) * 1000)
+        busy = self.run_frame_hooks() or busy
+        try:
+            await end_frame()
+            return await self.wait_async(framerate, busy)
+        finally:
+            self.frame_started = time.perf_counter()
+
+    async def wait_async(self, framerate, busy):
+        now = pygame.time.get_ticks()
+        if busy or self.input_seen():
+            self.last_active = now
+
+        if not framerate or now - self.last_active < IDLE_AFTER_MS:
+            if framerate:
+                # pygame's Clock would block, so sleep out what's left of
+                # the frame and only let it keep count.
+                remaining = 1.0 / framerate - (time.perf_counter() - self.frame_ended)
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+            return self.end_tick()
+
+        # Background tasks only resume on a JOB_DONE event or at the next
+        # frame, so the event loop has nothing to do until input or a job
+        # arrives and can block with the rest of the game.
+        if self.wait_for_input(IDLE_FRAME_MS - now % IDLE_FRAME_MS):
+            self.last_active = pygame.time.get_ticks()
+        return self.end_tick()
+
+    def end_tick(self):
+        self.frame_ended = time.perf_counter()
+        return self.clock.tick()
+
+    def get_fps(self):
+        return self.clock.get_fps()
@@ -0,0 +1,110 @@
+import asyncio, inspect
+
+from jobs import submit
+
+"""This module runs the game on an asyncio event loop, so a screen can
+hand slow work like disk reads and writes to a background task and keep
+drawing frames until it's done.
+
+Screens move over one at a time. A screen whose loop is an 'async def'
+is awaited, and ends each frame with 'await clock.tick_async(...)'
+instead of clock.tick(), which lets any background tasks run before the
+clock waits out the rest of the frame. Screens that haven't moved over
+are called as before and simply hold up the event loop while they run.
+
+Background tasks are started with start() and should only wait on
+run_io(), wait_io() and next_frame(). Both resume at a set point in the frame,
+run_io() when the screen hands the job's JOB_DONE event to finish_job()
+and next_frame() when the screen ticks the clock, so a recorded session
+replays with every task resuming in exactly the same frame. Waiting on
+asyncio.sleep() or wall clock time would break that.
+"""
+
+# Futures of tasks waiting for the next frame.
+frame_waiters = []
+
+
+def run(main):
+    """Runs coroutine 'main' on a new event loop until it finishes.
+    """
+    return asyncio.run(main)
+
+async def run_screen(loop, game_state):
+    """Runs one screen's loop, awaiting it if it has moved over to
+    asyncio and calling it if it hasn't.
+    """
+    if inspect.iscoroutinefunction(loop):
+        return await loop(game_state)
+    return loop(game_state)
+
+def start(coroutine):
+    """Runs 'coroutine' as a background task alongside the screen. Cancel
+    the task once the screen no longer needs it.
+    """
+    return asyncio.get_running_loop().create_task(coroutine)
+
+def capture(f, *args):
+    """Runs f(*args), returning its result or the error it raised, so
+    the error reaches the task waiting on it rather than the screen.
+    """
+    try:
+        return (True, f(*args))
+    except Exception as error:
+        return (False, error)
+
+def submit_io(f, *args):
+    """Starts f(*args) on the job pool straight away. Returns a future a
+    task can await for its result, and the job's own future, which can
+    be cancelled at once, even while the event loop isn't running.
+    """
+    done = asyncio.get_running_loop().create_future()
+
+    def finished(outcome):
+        if done.cancelled():
+            return
+        ok, value = outcome
+        if ok:
+            done.set_result(value)
+        else:
+            done.set_exception(value)
+
+    return done, submit(capture, f, *args, on_done=finished)
+
+async def run_io(f, *args):
+    """Runs f(*args) on the job pool and waits for its result, without
+    holding up the frame. Cancelling the waiting task cancels the job if
+    it hasn't started yet.
+    """
+    done, future = submit_io(f, *args)
+    return await wait_io(done, future)
+
+async def wait_io(done, future):
+    """Waits for a job started with submit_io(), cancelling it if the
+    waiting task is cancelled.
+    """
+    try:
+        return await done
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+
+async def next_frame():
+    """Waits for the screen to finish its current frame. Long work in a
+    background task should await this every so often so it's spread
+    over several frames.
+    """
+    waiter = asyncio.get_running_loop().create_future()
+    frame_waiters.append(waiter)
+    await waiter
+
+async def end_frame():
+    """Called by the clock at the end of each frame. Wakes the tasks
+    waiting for it and lets every task that's ready run up to its next
+    wait.
+    """
+    waiters = frame_waiters[:]
+    del frame_waiters[:]
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(None)
+    await asyncio.sleep(0)
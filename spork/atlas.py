@@ -0,0 +1,163 @@
+import pygame, os, json, hashlib, threading
+
+from telemetry import timed
+
+"""This module packs the small button and icon images into one sheet,
+so the whole set is decoded in one go and every button after that is a
+subsurface of it rather than a file of its own.
+
+The sheet and an index of where each image sits on it are built from
+data/imgbase the first time they're needed, and again whenever one of
+the images changes, into data/temp/atlas. The sheet is kept as raw
+pixels in the layout pygame uses for transparent surfaces, so loading
+it is a plain copy with no PNG decoding or format conversion. Run this
+module directly to build them up front. image_cache serves the images
+from here, so sprites just load them by path as usual.
+"""
+
+IMAGES_DIR = os.getcwd() + '/data/imgbase'
+ATLAS_DIR = os.getcwd() + '/data/temp/atlas'
+SHEET_PATH = ATLAS_DIR + '/ui.bgra'
+INDEX_PATH = ATLAS_DIR + '/ui.json'
+
+ATLAS_IMAGES = (
+    'addbuttonsmall.png',
+    'copybuttonsmall.png',
+    'cropbuttonsmall.png',
+    'delbuttonsmall.png',
+    'deletebuttonsmall.png',
+    'flipbuttonsmall.png',
+    'helpbuttonsmall.png',
+    'mirrorbuttonsmall.png',
+    'mirrorcropbuttonsmall.png',
+    'splicebuttonsmall.png',
+    'tickbuttonsmall.png',
+    'arrow-up.png',
+    'arrow-down.png',
+    'arrow-left.png',
+    'arrow-right.png',
+    'mouseleft.png',
+    'mouseright.png',
+)
+
+SHEET_WIDTH = 1024
+
+# Gap left around each image so smoothing one never picks up another.
+PADDING = 1
+
+# The loaded sheet, and its images keyed by (path, trimmed) as
+# (surface, offset) in the same form image_cache returns them.
+sheet = None
+images = None
+
+# Held while the sheet loads, worker threads may ask for it too.
+lock = threading.Lock()
+
+
+def sheet_version():
+    """Identifies the versions of every image in the atlas.
+    """
+    versions = []
+    for name in ATLAS_IMAGES:
+        stat = os.stat(IMAGES_DIR + '/' + name)
+        versions.append('{0}|{1}|{2}'.format(name, stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha1('\n'.join(versions).encode('utf-8')).hexdigest()
+
+def pack(sizes):
+    """Places rectangles of the given sizes in rows across the sheet,
+    tallest first. Returns their positions, in the same order, and the
+    height of the sheet.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    positions = [None] * len(sizes)
+    x = y = row_height = 0
+    for i in order:
+        w, h = sizes[i][0] + PADDING * 2, sizes[i][1] + PADDING * 2
+        if x + w > SHEET_WIDTH:
+            x, y, row_height = 0, y + row_height, 0
+        positions[i] = (x + PADDING, y + PADDING)
+        x += w
+        row_height = max(row_height, h)
+    return positions, y + row_height
+
+def build_sheet(version):
+    """Packs every atlas image into a sheet and writes it and its index
+    out. Returns both.
+    """
+    loaded = []
+    for name in ATLAS_IMAGES:
+        # Put on a transparent surface just as image_cache would, so the
+        # pixels are exactly those of the image loaded on its own.
+        source = pygame.image.load(IMAGES_DIR + '/' + name)
+        image = pygame.Surface(source.get_size(), pygame.SRCALPHA, 32)
+        image.blit(source, (0, 0))
+        loaded.append(image)
+
+    positions, height = pack([image.get_size() for image in loaded])
+    built = pygame.Surface((SHEET_WIDTH, height), pygame.SRCALPHA, 32)
+    index = {'version': version, 'size': built.get_size(), 'images': {}}
+    for name, image, position in zip(ATLAS_IMAGES, loaded, positions):
+        # Copied rather than blended onto the empty sheet.
+        built.blit(image, position, special_flags=pygame.BLEND_RGBA_MAX)
+        bounds = image.get_bounding_rect()
+        if not (bounds.w and bounds.h):
+            bounds = image.get_rect()
+        index['images'][name] = [position[0], position[1], image.get_width(), image.get_height(),
+                                 bounds.x, bounds.y, bounds.w, bounds.h]
+
+    if not os.path.isdir(ATLAS_DIR):
+        os.makedirs(ATLAS_DIR)
+
+    # Write then rename so a half written sheet is never picked up. The
+    # index goes last, so it never points at an older sheet.
+    with open(SHEET_PATH + '.part', 'wb') as f:
+        f.write(pygame.image.tostring(built, 'BGRA'))
+    os.replace(SHEET_PATH + '.part', SHEET_PATH)
+    with open(INDEX_PATH + '.part', 'w') as f:
+        json.dump(index, f)
+    os.replace(INDEX_PATH + '.part', INDEX_PATH)
+    return built, index
+
+def load_sheet():
+    """Loads the sheet, building it first if any image has changed, and
+    cuts it up into its images.
+    """
+    global sheet, images
+    with timed('load atlas', SHEET_PATH):
+        version = sheet_version()
+        index = None
+        if os.path.exists(INDEX_PATH) and os.path.exists(SHEET_PATH):
+            with open(INDEX_PATH) as f:
+                index = json.load(f)
+
+        if index and index.get('version') == version:
+            with open(SHEET_PATH, 'rb') as f:
+                sheet = pygame.image.frombytes(f.read(), tuple(index.get('size')), 'BGRA')
+        else:
+            sheet, index = build_sheet(version)
+
+        # Only published once complete, atlas_image() reads it unlocked.
+        cut = {}
+        for name, (x, y, w, h, tx, ty, tw, th) in index.get('images').items():
+            path = IMAGES_DIR + '/' + name
+            cut[(path, False)] = (sheet.subsurface((x, y, w, h)), (0, 0))
+            cut[(path, True)] = (sheet.subsurface((x + tx, y + ty, tw, th)), (tx, ty))
+        images = cut
+
+def atlas_image(path, trim=False):
+    """Returns the image at 'path' and its offset, as load_image() would,
+    if it's in the atlas. Otherwise returns None.
+    """
+    if os.path.dirname(path) != IMAGES_DIR:
+        return None
+    if images is None:
+        with lock:
+            if images is None:
+                load_sheet()
+    return images.get((path, trim))
+
+
+if __name__ == '__main__':
+    pygame.init()
+    build_sheet(sheet_version())
+    print('Packed {0} images into {1}'.format(len(ATLAS_IMAGES), SHEET_PATH))
@@ -0,0 +1,108 @@
+import pygame, os, io, mmap, struct, zipfile, zlib
+
+"""This module lets extra components ship as packs, zip archives of
+PNGs dropped into data/packs, alongside the ones in
+data/pixel-components.
+
+Indexing a pack only reads the zip's central directory at the end of
+the file, so a pack of hundreds of components costs next to nothing
+until they're used. Each archive is memory mapped, and an image is
+decoded straight out of the mapping the first time it's loaded. Slicing
+the mapping needs no shared file position, so worker threads can decode
+from the same pack at once.
+
+Components in a pack have paths like 'data/packs/kitchen.zip/pixel-
+whisk.png'. image_cache loads them from here into the same cache as
+every other image, so component images must be loaded through its
+load_image() rather than pygame.image.load().
+"""
+
+COMPONENTS_DIR = os.getcwd() + '/data/pixel-components'
+PACK_DIR = os.getcwd() + '/data/packs'
+
+# Indexed packs keyed by archive path, read on first use, as the mapped
+# archive and its members' ZipInfos keyed by name.
+packs = None
+
+# Size of a zip local file header, before its name and extra field.
+LOCAL_HEADER_SIZE = 30
+
+
+def index_packs():
+    """Indexes every pack in PACK_DIR, skipping any that aren't zips.
+    """
+    global packs
+
+    packs = {}
+    if not os.path.isdir(PACK_DIR):
+        return packs
+
+    for name in sorted(os.listdir(PACK_DIR)):
+        if not name.endswith('.zip'):
+            continue
+        path = PACK_DIR + '/' + name
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = {info.filename: info for info in archive.infolist() if info.filename.endswith('.png')}
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            packs[path] = (mapped, members)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            print('Skipping component pack {0}, it can\'t be read'.format(name))
+    return packs
+
+def component_files():
+    """Returns the paths of every component, the unpacked ones first,
+    then each pack's in turn.
+    """
+    if packs is None:
+        index_packs()
+
+    files = [COMPONENTS_DIR + '/' + name for name in sorted(os.listdir(COMPONENTS_DIR))]
+    for path, (mapped, members) in packs.items():
+        files.extend(path + '/' + member for member in sorted(members))
+    return files
+
+def component_name(path):
+    """The name a component is shown under.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.startswith('pixel-'):
+        name = name[len('pixel-'):]
+    return name
+
+def pack_member(path):
+    """Returns the pack and member name of a packed component's 'path',
+    or None if it isn't in a pack.
+    """
+    if not path.startswith(PACK_DIR + '/') or '.zip/' not in path:
+        return None
+    if packs is None:
+        index_packs()
+
+    archive, member = path.split('.zip/', 1)
+    archive += '.zip'
+    if archive not in packs:
+        return None
+    return archive, member
+
+def load_packed(path):
+    """Decodes the packed image at 'path'. Safe to call from worker
+    threads.
+    """
+    archive, member = pack_member(path)
+    mapped, members = packs[archive]
+    info = members.get(member)
+    if info is None:
+        raise FileNotFoundError(path)
+
+    # The member's data follows its local header, whose name and extra
+    # field can differ in length from the central directory's.
+    name_length, extra_length = struct.unpack('<HH', mapped[info.header_offset + 26:info.header_offset + 30])
+    start = info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length
+    data = mapped[start:start + info.compress_size]
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    elif info.compress_type != zipfile.ZIP_STORED:
+        raise OSError('{0} is compressed in a way packs don\'t support'.format(path))
+    return pygame.image.load(io.BytesIO(data), member)
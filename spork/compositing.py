@@ -0,0 +1,206 @@
+import pygame, os, time, random, weakref
+
+from pil_bridge import rgba_surface
+
+"""This module composites sprites onto a transparent canvas with
+premultiplied alpha where it matters, for saving spliced inventions.
+
+Blitting a translucent sprite onto a transparent surface mixes its
+colour with whatever partly transparent colour is already there without
+weighing it by that pixel's alpha, so where two soft edges overlap the
+result comes out too dark or too light. Everywhere else a plain blit is
+exact. So sprites are blitted as usual, and only the areas where one
+sprite's translucent pixels land on another's are drawn again with
+premultiplied alpha, which is exact, then turned back to straight alpha
+by PIL. When sprites overlap over most of the canvas, the whole canvas
+is drawn premultiplied in one go instead.
+
+This is about getting the edges right, not speed: with many overlapping
+sprites it takes somewhat longer than drawing the group.
+
+Each sprite image is premultiplied once and kept for as long as the
+image lives, so copies of a sprite share it, and the layers are blended
+by pygame's premultiplied blit.
+
+Run this module directly to benchmark it against drawing the group.
+"""
+
+# Premultiplied copies of sprite images, they live exactly as long as the
+# image they were made from.
+layers = weakref.WeakKeyDictionary()
+
+# Masks of the translucent pixels of sprite images, kept the same way.
+edges = weakref.WeakKeyDictionary()
+
+# PIL's raw modes for premultiplied pixels, keyed by the channel shifts
+# of a surface.
+RAW_MODES = {
+    (16, 8, 0, 24): 'BGRa',
+    (0, 8, 16, 24): 'RGBa',
+}
+
+
+def premultiplied(image):
+    if image not in layers:
+        layers[image] = image.premul_alpha()
+    return layers[image]
+
+def unpremultiply(surface):
+    """Returns a straight alpha copy of the premultiplied 32 bit
+    'surface'.
+    """
+    from PIL import Image
+
+    if surface.get_shifts() not in RAW_MODES:
+        surface = rgba_surface(surface)
+
+    view = surface.get_view('2')
+    image = Image.frombuffer('RGBa', surface.get_size(), view, 'raw', RAW_MODES[surface.get_shifts()], surface.get_pitch(), 1)
+    straight = image.convert('RGBA')
+    image.close()
+    del image, view
+    # PIL's own channel order packs fastest, blits convert it as needed.
+    return pygame.image.frombuffer(straight.tobytes(), surface.get_size(), 'RGBA')
+
+def merge_rects(rects):
+    """Returns rectangles covering 'rects', with any that overlap merged
+    so that none of them overlap each other.
+    """
+    merged = []
+    for rect in rects:
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+def overlap_regions(rects):
+    """Returns rectangles covering everywhere two or more of 'rects'
+    overlap, none of them overlapping each other.
+    """
+    overlaps = []
+    for i, rect in enumerate(rects):
+        overlaps.extend(rect.clip(rects[j]) for j in rect.collidelistall(rects[:i]))
+    return merge_rects(overlaps)
+
+def translucent_mask(image):
+    """Returns the mask of the pixels of 'image' that are neither clear
+    nor opaque, made once for as long as the image lives.
+    """
+    if image not in edges:
+        mask = pygame.mask.from_surface(image, 0)
+        mask.erase(pygame.mask.from_surface(image, 254), (0, 0))
+        edges[image] = mask
+    return edges[image]
+
+def edge_overlaps(sprites, region):
+    """Returns rectangles covering every pixel in 'region' where a
+    translucent pixel of one sprite lands on a translucent pixel of an
+    earlier one. Only those pixels can come out wrong from a plain blit.
+    """
+    seen = pygame.mask.Mask(region.size)
+    overlaps = pygame.mask.Mask(region.size)
+    for sprite in sprites:
+        if sprite.rect.colliderect(region):
+            mask = translucent_mask(sprite.image)
+            offset = (sprite.rect.x - region.x, sprite.rect.y - region.y)
+            overlaps.draw(seen.overlap_mask(mask, offset), (0, 0))
+            seen.draw(mask, offset)
+    return [rect.move(region.topleft) for rect in overlaps.get_bounding_rects()]
+
+def premultiplied_layer(sprites, region):
+    """Returns the 'region' of the canvas with 'sprites' drawn on it,
+    premultiplied and back to straight alpha.
+    """
+    layer = pygame.Surface(region.size, pygame.SRCALPHA, 32)
+    for sprite in sprites:
+        if sprite.rect.colliderect(region):
+            layer.blit(premultiplied(sprite.image), sprite.rect.move(-region.x, -region.y),
+                       special_flags=pygame.BLEND_PREMULTIPLIED)
+    return unpremultiply(layer)
+
+def composite(sprites, size):
+    """Returns a transparent surface of 'size' with 'sprites' drawn on it
+    in order, as Group.draw would, but with correctly blended edges.
+    """
+    bounds = pygame.Rect((0, 0), size)
+    regions = overlap_regions([sprite.rect.clip(bounds) for sprite in sprites])
+    if sum(region.w * region.h for region in regions) * 2 > bounds.w * bounds.h:
+        return premultiplied_layer(sprites, bounds)
+
+    surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+    for sprite in sprites:
+        surface.blit(sprite.image, sprite.rect)
+    for region in merge_rects([rect for region in regions for rect in edge_overlaps(sprites, region)]):
+        # Replace the region, rather than blending over it.
+        surface.fill((0, 0, 0, 0), region)
+        surface.blit(premultiplied_layer(sprites, region), region, special_flags=pygame.BLEND_RGBA_MAX)
+    return surface
+
+def draw_composite(sprites, size, screen_size):
+    """The way inventions were composited before, for comparison: drawn
+    on a transparent canvas, then copied onto a transparent screen sized
+    surface and cut back out.
+    """
+    transparent_surface = pygame.Surface(screen_size, pygame.SRCALPHA, 32)
+    canvas = pygame.Surface(size, pygame.SRCALPHA, 32)
+    sprites.draw(canvas)
+    transparent_surface.blit(canvas, (0, 0))
+    return transparent_surface.subsurface(pygame.Rect((0, 0), size))
+
+def edge_error(surface, sprites, size):
+    """The worst difference, weighted by how opaque it is, between any
+    pixel of 'surface' and the same pixel composited exactly in floating
+    point.
+    """
+    import numpy
+
+    exact = numpy.zeros(size + (4,))
+    for sprite in sprites:
+        area = sprite.rect.clip(pygame.Rect((0, 0), size))
+        if not area.w or not area.h:
+            continue
+        layer = numpy.dstack([pygame.surfarray.array3d(sprite.image), pygame.surfarray.array_alpha(sprite.image)]) / 255.0
+        layer[..., :3] *= layer[..., 3:]
+        x, y = area.x - sprite.rect.x, area.y - sprite.rect.y
+        target = exact[area.left:area.right, area.top:area.bottom]
+        target *= 1 - layer[x:x + area.w, y:y + area.h, 3:]
+        target += layer[x:x + area.w, y:y + area.h]
+
+    got = numpy.dstack([pygame.surfarray.array3d(surface), pygame.surfarray.array_alpha(surface)]) / 255.0
+    got[..., :3] *= got[..., 3:]
+    return float(numpy.abs(got - exact).max() * 255)
+
+def benchmark(repeats=20):
+    from sprites.base_sprites import ImageSprite
+
+    pygame.display.set_mode((1, 1))
+    size = (762, 627)
+    components = [os.getcwd() + '/data/pixel-components/' + name for name in ('pixel-mug.png', 'pixel-spoon.png')]
+    random.seed(1)
+
+    for count in (2, 10, 50):
+        sprites = pygame.sprite.OrderedUpdates()
+        for i in range(count):
+            sprite = ImageSprite(0, 0, components[i % 2])
+            sprite.rotation = random.choice(range(0, 360, 30))
+            sprite.scale = random.randint(20, 60)
+            sprite.rect.center = (random.randint(0, size[0]), random.randint(0, size[1]))
+            sprite.update_sprite()
+            sprite.use_smooth_image(wait=True)
+            sprites.add(sprite)
+
+        results = []
+        for f in (lambda: draw_composite(sprites, size, (1200, 675)), lambda: composite(sprites, size)):
+            started = time.perf_counter()
+            for i in range(repeats):
+                surface = f()
+            results.append(((time.perf_counter() - started) * 1000 / repeats, edge_error(surface, sprites, size)))
+
+        print('{0:3d} layers   draw {1:6.2f} ms, worst error {2:5.1f}   composite {3:6.2f} ms, worst error {4:5.1f}'.format(
+            count, results[0][0], results[0][1], results[1][0], results[1][1]))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,7 +1,7 @@
 import pygame, sys, os
-from PIL import Image
 
-pygame.init()
+from jobs import JOB_DONE, WORK_DONE, finish_job, finish_work
+from image_cache import load_image
 
 def displayImage(screen, px, topleft, prior, image_offset, crop_surface):
     # ensure that the rect always has positive width, height
@@ -43,7 +43,8 @@ def setup(path, mirror = False):
     crop_surface = (1200, 625)
     image_offset = (500,50)
 
-    px = pygame.image.load(path)
+    # Shared with the image cache, so it's only read from.
+    px, offset = load_image(path)
     
     
     screen = pygame.display.set_mode( (crop_surface) )
@@ -68,6 +69,10 @@ def cropLoop(screen, px, crop_surface, image_offset, confirm_crop):
         if new_rect.collidepoint(pygame.mouse.get_pos()) == True:
               
             for event in pygame.event.get():
+                if event.type == JOB_DONE:
+                    finish_job(event)
+                if event.type == WORK_DONE:
+                    finish_work(event)
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     x=1
                 if x ==1:
@@ -84,17 +89,20 @@ def cropLoop(screen, px, crop_surface, image_offset, confirm_crop):
             return ( topleft + bottomright )
 
 if __name__ == "__main__":
+    from pil_bridge import surface_image, image_surface
+
+    pygame.init()
     input_loc = 'u.png'
     output_loc = 'out.png'
-    screen, px = setup(input_loc)
-    left, upper, right, lower = cropLoop(screen, px)
+    screen, px, crop_surface, image_offset = setup(input_loc)
+    left, upper, right, lower = cropLoop(screen, px, crop_surface, image_offset, None)
 
     # ensure output rect always has positive width, height
     if right < left:
         left, right = right, left
     if lower < upper:
         lower, upper = upper, lower
-    im = Image.open(input_loc)
-    im = im.crop(( left, upper, right, lower))
+    with surface_image(px) as im:
+        im = im.crop(( left-image_offset[0], upper-image_offset[1], right-image_offset[0], lower-image_offset[1]))
     pygame.display.quit()
-    im.save(output_loc)
+    pygame.image.save(image_surface(im), output_loc)
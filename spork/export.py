@@ -0,0 +1,169 @@
+import os, sys, json, math, struct, zlib, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+
+"""This module exports inventions at several times the size they're made
+at on screen, for printing.
+
+Rather than enlarging the saved screenshot, every sprite of the splice
+is drawn again from its component image, rotated and scaled to its
+place at the export size. Pixels are picked nearest neighbour, so the
+pixel art stays sharp at any size.
+
+Exports run in their own process, started with 'python export.py SPEC
+OUT', so the game doesn't slow down while one is drawn. The process is
+started and waited for by a thread of the export's own, rather than the
+job pool, so a long export never holds up the game's jobs or shifts
+their numbering, and WORK_DONE hands the result back. The image is drawn and written out a band of rows at a time into
+a streamed PNG, so a large export never needs the whole image in memory.
+Exports go next to the invention in data/inventions/exports.
+"""
+
+EXPORT_DIR = os.getcwd() + '/data/inventions/exports'
+
+# Rows drawn and compressed at a time.
+BAND_HEIGHT = 128
+
+# Starts export processes and waits for them, one at a time.
+exporter = ThreadPoolExecutor(max_workers=1)
+
+
+def export_path(img_path, scale):
+    name = os.path.splitext(os.path.basename(img_path))[0]
+    return '{0}/{1}-x{2}.png'.format(EXPORT_DIR, name, scale)
+
+def export_invention(sprites, canvas_size, img_path, scale, on_done=None):
+    """Exports the invention made from 'sprites', drawn on a canvas of
+    'canvas_size', at 'scale' times the size. Runs in the background
+    and calls on_done with the export's path, or None if it couldn't be
+    drawn, once it is written.
+    """
+    # Component images are shared and never drawn on, so the export
+    # thread can read them after the sprites have moved on.
+    states = [(sprite.origimage, sprite.rotation, sprite.scale, sprite.rect.center) for sprite in sprites]
+    return exporter.submit(run_export, states, canvas_size, export_path(img_path, scale), scale, on_done)
+
+def run_export(states, canvas_size, path, scale, on_done):
+    """Writes out the export's spec, starts a separate process to draw
+    it and waits for that to finish. Runs on the export thread.
+    """
+    # Imported here so the export process itself doesn't need pygame.
+    import pygame
+    from jobs import post_work_done
+
+    if not os.path.isdir(EXPORT_DIR):
+        os.makedirs(EXPORT_DIR)
+
+    spec = {'canvas_size': list(canvas_size), 'scale': scale, 'sprites': []}
+    arrays = {}
+    for i, (image, rotation, sprite_scale, center) in enumerate(states):
+        w, h = image.get_size()
+        pixels = pygame.image.tostring(image, 'RGBA')
+        arrays['sprite{0}'.format(i)] = numpy.frombuffer(pixels, numpy.uint8).reshape(h, w, 4)
+        spec['sprites'].append({'rotation': rotation, 'scale': sprite_scale, 'center': list(center)})
+    spec_path = path + '.spec.npz'
+    numpy.savez(spec_path, spec=json.dumps(spec), **arrays)
+
+    try:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), spec_path, path])
+        result = path if process.wait() == 0 else None
+    except OSError:
+        result = None
+    finally:
+        os.remove(spec_path)
+    post_work_done(on_done, result)
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def premultiplied(pixels):
+    """Returns 'pixels' as floats between 0 and 1 with the colour
+    multiplied by alpha, so drawing one over another is a single sum.
+    """
+    image = pixels.astype(numpy.float32) / 255
+    image[..., :3] *= image[..., 3:]
+    return image
+
+def draw_band(band, top, sprites, scale):
+    """Draws every sprite over the 'band' of rows starting at 'top'.
+    """
+    height, width = band.shape[:2]
+    for image, rotation, sprite_scale, center in sprites:
+        h, w = image.shape[:2]
+        s = sprite_scale / 100.0
+        radians = math.radians(rotation)
+        cos, sin = math.cos(radians), math.sin(radians)
+
+        # Only work on the part of the band the rotated sprite covers.
+        half_w = (abs(w * cos) + abs(h * sin)) * s / 2
+        half_h = (abs(w * sin) + abs(h * cos)) * s / 2
+        x0 = max(int((center[0] - half_w) * scale), 0)
+        x1 = min(int(math.ceil((center[0] + half_w) * scale)), width)
+        y0 = max(int((center[1] - half_h) * scale) - top, 0)
+        y1 = min(int(math.ceil((center[1] + half_h) * scale)) - top, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+
+        # Where each export pixel's centre falls on the canvas, relative
+        # to the sprite's centre, turned back through the rotation (which
+        # pygame makes anticlockwise) and the scale onto the image.
+        dx = (numpy.arange(x0, x1, dtype=numpy.float32) + 0.5) / scale - center[0]
+        dy = (numpy.arange(top + y0, top + y1, dtype=numpy.float32) + 0.5) / scale - center[1]
+        u = (dx[numpy.newaxis, :] * cos - dy[:, numpy.newaxis] * sin) / s + w / 2.0
+        v = (dx[numpy.newaxis, :] * sin + dy[:, numpy.newaxis] * cos) / s + h / 2.0
+
+        inside = (u >= 0) & (u < w) & (v >= 0) & (v < h)
+        source = image[numpy.where(inside, v, 0).astype(numpy.intp), numpy.where(inside, u, 0).astype(numpy.intp)]
+        source[~inside] = 0
+
+        target = band[y0:y1, x0:x1]
+        target *= 1 - source[..., 3:]
+        target += source
+
+def render(spec_path, path):
+    """Draws the export described in the spec at 'spec_path' to a PNG at
+    'path'.
+    """
+    with numpy.load(spec_path) as data:
+        spec = json.loads(str(data['spec']))
+        sprites = [
+            (premultiplied(data['sprite{0}'.format(i)]), entry.get('rotation'), entry.get('scale'), entry.get('center'))
+            for i, entry in enumerate(spec.get('sprites'))
+        ]
+
+    scale = spec.get('scale')
+    width = int(round(spec.get('canvas_size')[0] * scale))
+    height = int(round(spec.get('canvas_size')[1] * scale))
+
+    # Write then rename so a half written export is never picked up.
+    compressor = zlib.compressobj(6)
+    with open(path + '.part', 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+
+        for top in range(0, height, BAND_HEIGHT):
+            band = numpy.zeros((min(BAND_HEIGHT, height - top), width, 4), numpy.float32)
+            draw_band(band, top, sprites, scale)
+
+            # Back to straight alpha, then each row behind a zero byte
+            # for no PNG filtering.
+            alpha = band[..., 3:]
+            band[..., :3] /= numpy.where(alpha > 0, alpha, 1)
+            rows = numpy.zeros((band.shape[0], width * 4 + 1), numpy.uint8)
+            rows[:, 1:] = (band * 255 + 0.5).clip(0, 255).astype(numpy.uint8).reshape(band.shape[0], -1)
+
+            compressed = compressor.compress(rows.tobytes())
+            if compressed:
+                f.write(png_chunk(b'IDAT', compressed))
+
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+    os.replace(path + '.part', path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Draw an invention export.')
+    parser.add_argument('spec')
+    parser.add_argument('out')
+    args = parser.parse_args()
+    render(args.spec, args.out)
@@ -1,5 +1,7 @@
 import pygame
 
+from image_cache import hit_mask, pyramid_level
+
 """This module contains utility functions used throughout the game.
 """
 
@@ -10,15 +12,22 @@ def top_draggable_sprite_at_point(sprites, pos):
     position which is draggable.
 
     Reverses the sprite list so it finds sprites which are 'on top'
-    first.
+    first. The cheap rect test rules most sprites out, then the point is
+    checked against the sprite's cached alpha mask so clicks on
+    transparent corners fall through to whatever is underneath.
     """
     for sprite in reversed(sprites.sprites()):
         if sprite.is_draggable and sprite.rect.collidepoint(pos):
-            return sprite
+            local_pos = (int(pos[0] - sprite.rect.x), int(pos[1] - sprite.rect.y))
+            if hit_mask(sprite.image).get_at(local_pos):
+                return sprite
 
 def aspect_scale(img, target):
     """Scales 'img' to fit into box bx/by.  This method will retain the
      original image's aspect ratio
+
+    Loaded images are scaled from the nearest larger level of their
+    pyramid rather than from the full image.
     """
     bx, by = target
     ix, iy = img.get_size()
@@ -43,7 +52,8 @@ def aspect_scale(img, target):
         else:
             sy = by
 
-    return pygame.transform.scale(img, (int(sx), int(sy)))
+    source = pyramid_level(img, (int(sx), int(sy)))
+    return pygame.transform.scale(source, (int(sx), int(sy)))
 
 def draw_rects(rect_list, game_surface, colour, fill):
     for rect in rect_list:
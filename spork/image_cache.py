@@ -0,0 +1,310 @@
+import pygame, os, weakref, threading
+from collections import OrderedDict
+
+from jobs import submit
+from atlas import atlas_image
+from component_packs import pack_member, load_packed
+from telemetry import timed
+
+"""This module holds caches of loaded images, transformed images and
+their hit masks, so sprites in the same state share one surface and one
+mask instead of each redoing the work.
+"""
+
+# Guards the caches below, worker threads load and scale images too. It's
+# never held while an image is decoded or scaled.
+lock = threading.RLock()
+
+# Loaded images keyed by (path, trimmed), each stored with the version of
+# the file it was loaded from.
+images = {}
+
+# Halved copies of loaded images, largest first. Each loaded image gets
+# an entry, the levels themselves are built the first time it is scaled.
+pyramids = weakref.WeakKeyDictionary()
+
+# Pyramids stop once a level's shorter side would drop below this.
+MIN_LEVEL_SIZE = 32
+
+# Most transformed surfaces kept before the least recently used go.
+MAX_TRANSFORMS = 256
+
+# Transformed surfaces keyed by (source surface, rotation, scale).
+transforms = OrderedDict()
+
+# Smoothly transformed surfaces that have been handed over, keyed like
+# transforms.
+smooth_transforms = OrderedDict()
+
+# Smooth transforms still being made, as (future, functions waiting for
+# it) keyed like transforms.
+smooth_jobs = {}
+
+# Images made in memory, like crops, keyed by (name, trimmed) as
+# (surface, offset).
+made_images = {}
+
+# Futures of images still being written out, keyed by path.
+saves = {}
+
+# Most bytes of pixels the gallery thumbnails may take up between them.
+MAX_THUMBNAIL_BYTES = 16 * 1024 * 1024
+
+# Gallery thumbnails keyed by (path, size), least recently used first.
+# Unlike loaded images, the full size image isn't kept.
+thumbnails = OrderedDict()
+thumbnail_bytes = 0
+
+# Alpha masks for hit testing, they live exactly as long as the surface
+# they were made from.
+masks = weakref.WeakKeyDictionary()
+
+
+def file_version(path):
+    """Identifies the version of the file at 'path' on disk.
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def write_image(surface, path):
+    # Write then rename so a half written image is never picked up.
+    with open(path + '.part', 'wb') as f:
+        pygame.image.save(surface, f, path)
+    os.replace(path + '.part', path)
+
+def save_image(surface, path):
+    """Writes 'surface' to 'path' on a worker thread. Loading the path
+    through this module waits for the write to finish. Don't draw on
+    'surface' afterwards.
+    """
+    def saved(result):
+        if saves.get(path) is future:
+            del saves[path]
+
+    future = submit(write_image, surface, path, on_done=saved)
+    saves[path] = future
+
+def wait_for_save(path):
+    """Returns once any pending write of 'path' has finished.
+    """
+    future = saves.get(path)
+    if future is not None:
+        future.result()
+
+def load_image(path, trim=False):
+    """Returns the image at 'path' on a transparent 32 bit surface and
+    its offset within the file.
+
+    With 'trim' set, any fully transparent border is cut off the image
+    and the offset says where the trimmed area sat, so callers can keep
+    it in the same place. Images are only loaded and trimmed again when
+    the file changes. The returned surface is shared, don't draw on it.
+
+    Button and icon images come straight from the atlas sheet, and
+    packed components are decoded out of their pack.
+    """
+    in_atlas = atlas_image(path, trim)
+    if in_atlas:
+        return in_atlas
+
+    key = (path, trim)
+    with lock:
+        if key in made_images:
+            return made_images[key]
+
+    # Packs don't change while the game is running.
+    packed = pack_member(path)
+    if packed:
+        version = None
+    else:
+        wait_for_save(path)
+        version = file_version(path)
+
+    with lock:
+        entry = images.get(key)
+    if entry is None or entry[0] != version:
+        with timed('load image', path):
+            loaded = load_packed(path) if packed else pygame.image.load(path)
+            image, offset = prepare_image(loaded, trim)
+
+        with lock:
+            # Another thread may have loaded it meanwhile, keep theirs so
+            # everyone shares one surface.
+            entry = images.get(key)
+            if entry is None or entry[0] != version:
+                entry = (version, image, offset)
+                images[key] = entry
+                pyramids[image] = None
+
+    return entry[1], entry[2]
+
+def prepare_image(loaded, trim):
+    """Copies 'loaded' onto a transparent 32 bit surface, trimmed if
+    'trim' is set, and returns it with its offset.
+    """
+    image = pygame.Surface(loaded.get_size(), pygame.SRCALPHA, 32)
+    image.blit(loaded, (0, 0))
+    offset = (0, 0)
+
+    if trim:
+        bounds = image.get_bounding_rect()
+        if bounds.w and bounds.h and bounds.size != image.get_size():
+            image = image.subsurface(bounds).copy()
+            offset = bounds.topleft
+    return image, offset
+
+def add_image(name, loaded):
+    """Makes the surface 'loaded', made in memory rather than read from a
+    file, load through load_image() as 'name'.
+    """
+    for trim in (False, True):
+        image, offset = prepare_image(loaded, trim)
+        with lock:
+            made_images[(name, trim)] = (image, offset)
+            pyramids[image] = None
+
+def remove_image(name):
+    """Forgets the image added as 'name', so it can be freed once nothing
+    else holds it.
+    """
+    with lock:
+        for trim in (False, True):
+            made_images.pop((name, trim), None)
+
+def build_pyramid(image):
+    """Returns 'image' followed by smoothly halved copies of it, down to
+    MIN_LEVEL_SIZE.
+    """
+    levels = [image]
+    w, h = image.get_size()
+    while min(w, h) // 2 >= MIN_LEVEL_SIZE:
+        w, h = w // 2, h // 2
+        levels.append(pygame.transform.smoothscale(levels[-1], (w, h)))
+    return levels
+
+def pyramid_level(image, size):
+    """Returns the smallest level of the pyramid of 'image' that is at
+    least 'size', so scaling down starts from as few pixels as possible.
+    Images without a pyramid are returned as they are.
+    """
+    with lock:
+        if image not in pyramids:
+            return image
+        levels = pyramids[image]
+
+    if levels is None:
+        levels = build_pyramid(image)
+        with lock:
+            if pyramids.get(image) is None:
+                pyramids[image] = levels
+            levels = pyramids[image]
+
+    best = image
+    for level in levels:
+        w, h = level.get_size()
+        if w < size[0] or h < size[1]:
+            break
+        best = level
+    return best
+
+def cached_transform(source, rotation, scale, make):
+    """Returns the transformed surface for 'source' at 'rotation' and
+    'scale', calling make() to create it if it isn't cached yet.
+    """
+    key = (source, rotation, scale)
+    image = transforms.get(key)
+    if image is None:
+        image = make()
+        transforms[key] = image
+        if len(transforms) > MAX_TRANSFORMS:
+            transforms.popitem(last=False)
+    else:
+        transforms.move_to_end(key)
+    return image
+
+def cached_smooth_transform(source, rotation, scale, make, on_ready=None, wait=False):
+    """Returns the smoothly transformed surface for 'source' at
+    'rotation' and 'scale', starting make() as a background job if it
+    isn't cached yet.
+
+    Returns None while it is still being made, unless 'wait' is set, and
+    on_ready is called with it once its JOB_DONE is handed over, so it
+    lands on the same frame in a replay.
+    """
+    key = (source, rotation, scale)
+    image = smooth_transforms.get(key)
+    if image is not None:
+        smooth_transforms.move_to_end(key)
+        return image
+
+    if key not in smooth_jobs:
+        future = submit(make, on_done=lambda image: smooth_transform_done(key, image))
+        smooth_jobs[key] = (future, [])
+    future, waiting = smooth_jobs[key]
+
+    if wait:
+        image = future.result()
+        store_smooth_transform(key, image)
+        return image
+    if on_ready:
+        waiting.append(on_ready)
+    return None
+
+def store_smooth_transform(key, image):
+    smooth_transforms[key] = image
+    smooth_transforms.move_to_end(key)
+    if len(smooth_transforms) > MAX_TRANSFORMS:
+        smooth_transforms.popitem(last=False)
+
+def smooth_transform_done(key, image):
+    future, waiting = smooth_jobs.pop(key, (None, []))
+    store_smooth_transform(key, image)
+    for on_ready in waiting:
+        on_ready(image)
+
+def make_thumbnail(path, size):
+    """Loads the image at 'path' scaled down to fit 'size'. Can be run
+    on a worker thread.
+    """
+    wait_for_save(path)
+    loaded = pygame.image.load(path)
+    w, h = loaded.get_size()
+    scale = min(size[0] / float(w), size[1] / float(h), 1.0)
+    image = pygame.Surface(loaded.get_size(), pygame.SRCALPHA, 32)
+    image.blit(loaded, (0, 0))
+    return pygame.transform.smoothscale(image, (max(int(w * scale), 1), max(int(h * scale), 1)))
+
+def cached_thumbnail(path, size):
+    """Returns the cached thumbnail of 'path' at 'size', or None.
+    """
+    key = (path, size)
+    image = thumbnails.get(key)
+    if image is not None:
+        thumbnails.move_to_end(key)
+    return image
+
+def store_thumbnail(path, size, image):
+    """Caches a thumbnail, dropping the least recently used ones to
+    stay within MAX_THUMBNAIL_BYTES.
+    """
+    global thumbnail_bytes
+    key = (path, size)
+    if key in thumbnails:
+        return
+    thumbnails[key] = image
+    thumbnail_bytes += image.get_bytesize() * image.get_width() * image.get_height()
+    while thumbnail_bytes > MAX_THUMBNAIL_BYTES and len(thumbnails) > 1:
+        old_key, old = thumbnails.popitem(last=False)
+        thumbnail_bytes -= old.get_bytesize() * old.get_width() * old.get_height()
+
+def hit_mask(image):
+    """Returns the alpha mask of 'image', made the first time it is
+    asked for and reused until the image goes away.
+    """
+    with lock:
+        mask = masks.get(image)
+    if mask is None:
+        mask = pygame.mask.from_surface(image)
+        with lock:
+            mask = masks.setdefault(image, mask)
+    return mask
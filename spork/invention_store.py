@@ -0,0 +1,146 @@
+import pygame, os, json, time, hashlib, sqlite3
+
+from image_cache import save_image, saves
+
+"""This module keeps every invention made, across games, so the gallery
+can show them long after the game they were made in.
+
+Invention images are stored by the hash of their size and pixels, as
+data/inventions/blobs/<ab>/<hash>.png, so the name the player typed
+never ends up in a path and two identical inventions share one file.
+What was sold, by whom and for how much goes in an SQLite index beside
+them, so the gallery and anything else looking back through the history
+run indexed queries instead of reading every record.
+"""
+
+STORE_DIR = os.getcwd() + '/data/inventions'
+BLOB_DIR = STORE_DIR + '/blobs'
+INDEX_PATH = STORE_DIR + '/index.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    company TEXT NOT NULL,
+    component1 TEXT,
+    component2 TEXT,
+    score REAL,
+    measures TEXT,
+    earnings REAL NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS inventions_name ON inventions (name);
+CREATE INDEX IF NOT EXISTS inventions_company ON inventions (company, id);
+CREATE INDEX IF NOT EXISTS inventions_earnings ON inventions (earnings);
+"""
+
+# The index is only ever used from the main thread, opened on first use.
+connection = None
+
+
+def connect():
+    global connection
+    if connection is None:
+        if not os.path.isdir(STORE_DIR):
+            os.makedirs(STORE_DIR)
+        connection = sqlite3.connect(INDEX_PATH)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(SCHEMA)
+    return connection
+
+def use_store(path):
+    """Keeps inventions under 'path' from now on instead of in
+    data/inventions.
+    """
+    global STORE_DIR, BLOB_DIR, INDEX_PATH, connection
+
+    if connection is not None:
+        connection.close()
+        connection = None
+    STORE_DIR = path
+    BLOB_DIR = STORE_DIR + '/blobs'
+    INDEX_PATH = STORE_DIR + '/index.sqlite3'
+
+def blob_path(blob):
+    return '{0}/{1}/{2}.png'.format(BLOB_DIR, blob[:2], blob)
+
+def store_image(surface):
+    """Writes the invention on 'surface' to the store, unless an
+    identical one is already there, and returns its path. The write
+    happens on a worker thread, so don't draw on 'surface' afterwards.
+    """
+    # The size is hashed too, the same bytes can be laid out in more
+    # than one shape.
+    digest = hashlib.sha1('{0}x{1}:'.format(*surface.get_size()).encode())
+    digest.update(pygame.image.tostring(surface, 'RGBA'))
+    blob = digest.hexdigest()
+    path = blob_path(blob)
+
+    if path not in saves and not os.path.exists(path):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        save_image(surface, path)
+    return path
+
+def add_invention(product, company, earnings):
+    """Adds the product just sold to the index.
+    """
+    components = [os.path.basename(path) for path in product.get('components')]
+    measures = product.get('score') or {}
+    with connect() as db:
+        db.execute(
+            'INSERT INTO inventions (name, blob, company, component1, component2, score, measures, earnings, time) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                product.get('name'),
+                os.path.splitext(os.path.basename(product.get('img')))[0],
+                company,
+                components[0] if components else None,
+                components[1] if len(components) > 1 else None,
+                measures.get('score'),
+                json.dumps(measures),
+                earnings,
+                time.time(),
+            )
+        )
+
+def invention(row):
+    """Turns an index row back into the invention's record.
+    """
+    return {
+        'name': row['name'],
+        'img': blob_path(row['blob']),
+        'company': row['company'],
+        'components': [c for c in (row['component1'], row['component2']) if c],
+        'score': json.loads(row['measures'] or '{}'),
+        'earnings': row['earnings'],
+        'time': row['time'],
+    }
+
+def count_inventions():
+    return connect().execute('SELECT COUNT(*) FROM inventions').fetchone()[0]
+
+def load_inventions(offset=0, limit=-1):
+    """Returns inventions from the history, newest first.
+    """
+    rows = connect().execute(
+        'SELECT * FROM inventions ORDER BY id DESC LIMIT ? OFFSET ?', (limit, offset))
+    return [invention(row) for row in rows]
+
+def best_inventions(limit=10):
+    """Returns the highest earning inventions, for a leaderboard.
+    """
+    rows = connect().execute(
+        'SELECT * FROM inventions ORDER BY earnings DESC LIMIT ?', (limit,))
+    return [invention(row) for row in rows]
+
+def company_inventions(company):
+    """Returns everything 'company' has sold, newest first.
+    """
+    rows = connect().execute(
+        'SELECT * FROM inventions WHERE company = ? ORDER BY id DESC', (company,))
+    return [invention(row) for row in rows]
+
+def image_path(record):
+    return record.get('img')
@@ -0,0 +1,88 @@
+import pygame, os, itertools
+from concurrent.futures import ThreadPoolExecutor
+
+"""This module runs slow work, like decoding and scaling images or
+encoding PNGs, on a pool of worker threads so the render loop keeps
+going meanwhile. pygame lets go of the GIL while it loads, transforms
+and saves images, so the workers really do run alongside the game.
+
+A finished job posts a JOB_DONE event carrying its future. Screens pass
+these to finish_job() as they come through the event loop, which calls
+the job's on_done function with the result on the main thread. Until
+then whatever the job will replace stays on screen.
+
+Each job gets a number, in the order jobs are submitted. The session
+recorder writes down which poll each job finished in, so a replay hands
+the results over at exactly the same points.
+
+Long running work that would hog a pool worker, like an export drawn in
+a separate process, waits on its own thread instead and posts WORK_DONE
+when it's finished. Screens pass that to finish_work(). It isn't
+numbered or recorded, so it must not change anything a replay checks.
+"""
+
+JOB_DONE = pygame.event.custom_type()
+WORK_DONE = pygame.event.custom_type()
+
+pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 2))
+
+# Jobs whose results haven't been handed over yet, as (future, on_done)
+# keyed by job number.
+pending = {}
+
+job_numbers = itertools.count()
+
+
+def submit(f, *args, on_done=None):
+    """Runs f(*args) on a worker thread. Once it's done on_done, if
+    given, is called with its result by finish_job().
+    """
+    job = next(job_numbers)
+    future = pool.submit(f, *args)
+    pending[job] = (future, on_done)
+    future.add_done_callback(lambda future: post_done(job, future))
+    return future
+
+def post_done(job, future):
+    try:
+        pygame.event.post(pygame.event.Event(JOB_DONE, job=job, future=future))
+    except pygame.error:
+        # The game has already shut down.
+        pass
+
+def job_event(job):
+    """Waits for job number 'job' and returns its JOB_DONE event, or
+    None if there is no such job.
+    """
+    if job not in pending:
+        return None
+    future = pending[job][0]
+    if not future.cancelled():
+        # Waits without raising, finish_job() raises any error.
+        future.exception()
+    return pygame.event.Event(JOB_DONE, job=job, future=future)
+
+def finish_job(event):
+    """Hands the result of the job in a JOB_DONE event over to its
+    on_done function.
+    """
+    future, on_done = pending.pop(event.job, (None, None))
+    if on_done and not future.cancelled():
+        on_done(future.result())
+
+def post_work_done(on_done, result):
+    """Posts WORK_DONE from the thread running some work outside the
+    pool, so on_done is called with 'result' by finish_work().
+    """
+    try:
+        pygame.event.post(pygame.event.Event(WORK_DONE, on_done=on_done, result=result))
+    except pygame.error:
+        # The game has already shut down.
+        pass
+
+def finish_work(event):
+    """Hands the result in a WORK_DONE event over to its on_done
+    function.
+    """
+    if event.on_done:
+        event.on_done(event.result)
@@ -0,0 +1,133 @@
+import pygame, os
+
+from jobs import submit
+from telemetry import timed
+
+"""This module plays the background music, crossfading from one track to
+the next over several frames without holding up the game.
+
+Tracks are streamed from disk by pygame.mixer.music, which only plays
+one at a time. So for a crossfade the new track's opening plays as a
+Sound on a channel kept aside for music, fading in while the stream
+fades out. Once the fade is over the stream is switched to the new
+track, picking up where the Sound had got to. The clock calls update()
+once a frame to move the fade along.
+
+Each track's opening is decoded on the job pool the first time the
+track is asked for, and handed over on the main thread by its JOB_DONE.
+Only the opening is kept, a couple of hundred kilobytes. A track asked
+for before then starts as soon as it's handed over, and the old one
+keeps playing until then.
+"""
+
+# How long the old track takes to fade out while the new one fades in.
+FADE_MS = 1500
+
+# How much of each track's opening is kept for crossfading into it. More
+# than the fade, so a slow frame at the end of it doesn't run out.
+OPENING_MS = FADE_MS + 1000
+
+# Volume the music plays at once faded in.
+MUSIC_VOLUME = 1.0
+
+
+def music_path(name):
+    return os.getcwd() + '/data/sounds/music/' + name
+
+def decode_opening(name):
+    """Decodes the first OPENING_MS of the track 'name' into a Sound.
+    """
+    with timed('load music', name):
+        sound = pygame.mixer.Sound(music_path(name))
+        frequency, size, channels = pygame.mixer.get_init()
+        length = frequency * OPENING_MS // 1000 * (abs(size) // 8) * channels
+        return pygame.mixer.Sound(buffer=sound.get_raw()[:length])
+
+
+class MusicPlayer(object):
+    """Plays music tracks, by file name, through pygame.mixer.music and,
+    while crossfading, the channel after the ones sound effects use.
+    """
+
+    def __init__(self):
+        effect_channels = pygame.mixer.get_num_channels()
+        pygame.mixer.set_num_channels(effect_channels + 1)
+        self.channel = pygame.mixer.Channel(effect_channels)
+
+        # Decoded openings keyed by track name, None while still being
+        # decoded. They're kept, there are only a couple of tracks.
+        self.openings = {}
+        self.wanted = None
+        self.playing = None
+
+        # The track fading in on the channel and when it started, while
+        # crossfading.
+        self.fading_in = None
+        self.fade_started = None
+
+    def preload(self, name):
+        """Starts decoding the opening of the track 'name' in the
+        background so it can be crossfaded to without a wait.
+        """
+        if name not in self.openings:
+            self.openings[name] = None
+            submit(decode_opening, name, on_done=lambda sound: self.openings.update({name: sound}))
+
+    def play(self, name):
+        """Crossfades to the track 'name', looping it. Returns straight
+        away, whether or not its opening has been decoded yet.
+        """
+        self.preload(name)
+        self.wanted = name
+
+    def update(self):
+        """Moves any crossfade along. Returns True while the music is
+        fading, so the clock keeps to the full frame rate until it's
+        done.
+        """
+        if self.fading_in:
+            return self.crossfade()
+        if self.wanted == self.playing or self.openings.get(self.wanted) is None:
+            return False
+
+        self.fading_in = self.wanted
+        self.fade_started = pygame.time.get_ticks()
+        self.channel.set_volume(0)
+        self.channel.play(self.openings[self.wanted])
+        return self.crossfade()
+
+    def crossfade(self):
+        elapsed = pygame.time.get_ticks() - self.fade_started
+        if elapsed < FADE_MS and self.fading_in == self.wanted:
+            self.channel.set_volume(MUSIC_VOLUME * elapsed / FADE_MS)
+            if self.playing:
+                pygame.mixer.music.set_volume(MUSIC_VOLUME * (1 - elapsed / FADE_MS))
+            return True
+
+        if self.fading_in == self.wanted:
+            # Hand over to the stream where the opening has got to.
+            pygame.mixer.music.load(music_path(self.fading_in))
+            pygame.mixer.music.set_volume(MUSIC_VOLUME)
+            pygame.mixer.music.play(loops=-1, start=elapsed / 1000.0)
+            self.playing = self.fading_in
+        else:
+            # Asked for another track meanwhile, drop this one.
+            pygame.mixer.music.set_volume(MUSIC_VOLUME)
+        self.channel.stop()
+        self.fading_in = None
+        # Another track may have been asked for meanwhile.
+        return self.wanted != self.playing
+
+    def stop(self):
+        self.wanted = None
+        self.playing = None
+        self.fading_in = None
+        self.channel.stop()
+        pygame.mixer.music.stop()
+
+    def close(self):
+        """Stops the music and lets go of the stream, so the mixer can
+        be shut down safely.
+        """
+        self.stop()
+        pygame.mixer.music.unload()
@@ -0,0 +1,99 @@
+import pygame, os, time, io
+from contextlib import contextmanager
+
+"""This module hands pixels between pygame surfaces and PIL images in
+memory, so PIL's crops, resizes and filters can work on the surfaces
+the game already has rather than on PNG files written out for them.
+
+surface_image() gives PIL a view straight onto a surface's pixels, with
+nothing copied. That works for 32 bit surfaces laid out as RGBA bytes,
+which is how pygame loads PNGs with transparency. Other surfaces are
+converted to that layout first. image_surface() wraps the bytes of a
+PIL image as a surface, at the cost of the one copy PIL makes of them.
+
+PIL is only imported when it's first used, so it isn't loaded at
+startup. Run this module directly to benchmark it against going
+through files.
+"""
+
+RGBA_MASKS = (0xff, 0xff00, 0xff0000, 0xff000000)
+
+
+def rgba_surface(surface):
+    """Returns 'surface' if its pixels are RGBA bytes, otherwise a copy
+    of it that is.
+    """
+    if surface.get_bitsize() == 32 and surface.get_masks() == RGBA_MASKS:
+        return surface
+    converted = pygame.Surface(surface.get_size(), pygame.SRCALPHA, 32, masks=RGBA_MASKS)
+    converted.blit(surface, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+    return converted
+
+@contextmanager
+def surface_image(surface):
+    """Gives a read only PIL image sharing the pixels of 'surface'. The
+    surface stays locked, so can't be blitted, until the block ends, and
+    the image mustn't be used after it.
+    """
+    from PIL import Image
+
+    surface = rgba_surface(surface)
+    view = surface.get_view('2')
+    image = Image.frombuffer('RGBA', surface.get_size(), view, 'raw', 'RGBA', surface.get_pitch(), 1)
+    try:
+        yield image
+    finally:
+        image.close()
+        del image, view
+
+def image_surface(image):
+    """Returns a surface over the pixels of PIL 'image'.
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    return pygame.image.frombuffer(image.tobytes(), image.size, 'RGBA')
+
+def file_apply(path, f):
+    """Runs PIL operation 'f' on the image at 'path' the way it used to
+    be done, through PNG files, for comparison.
+    """
+    from PIL import Image
+
+    image = f(Image.open(path))
+    out = io.BytesIO()
+    image.save(out, 'png')
+    out.seek(0)
+    return pygame.image.load(out, 'outie.png')
+
+def bridge_apply(surface, f):
+    with surface_image(surface) as image:
+        result = f(image)
+    return image_surface(result)
+
+def benchmark(repeats=10):
+    from PIL import Image, ImageFilter
+
+    for name in ('pixel-mug.png', 'pixel-wheel.png', 'pixel-scissors.png'):
+        path = os.getcwd() + '/data/pixel-components/' + name
+        surface = pygame.image.load(path)
+        w, h = surface.get_size()
+        print('{0} {1}x{2}'.format(name, w, h))
+
+        operations = (
+            ('crop', lambda image: image.crop((w // 4, h // 4, w * 3 // 4, h * 3 // 4))),
+            ('half size', lambda image: image.resize((w // 2, h // 2), Image.BILINEAR)),
+            ('blur', lambda image: image.filter(ImageFilter.BoxBlur(2))),
+        )
+        for label, operation in operations:
+            timings = []
+            for f in (lambda: file_apply(path, operation), lambda: bridge_apply(surface, operation)):
+                started = time.perf_counter()
+                for i in range(repeats):
+                    result = f()
+                timings.append((time.perf_counter() - started) * 1000 / repeats)
+            same = pygame.image.tostring(file_apply(path, operation), 'RGBA') == pygame.image.tostring(bridge_apply(surface, operation), 'RGBA')
+            print('  {0:10} files {1:7.2f} ms   bridge {2:7.2f} ms   same pixels {3}'.format(label, timings[0], timings[1], same))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,296 @@
+import pygame, json, random, hashlib, shutil, tempfile
+
+from jobs import JOB_DONE, job_event, pending
+from image_cache import wait_for_save
+from async_runner import end_frame
+
+"""This module records a play session's input so it can be replayed
+later, headlessly and as fast as the machine allows.
+
+A recording is a JSON lines file. The first line holds the random seed,
+each following line holds the input seen by one call to
+pygame.event.get() (only calls where something happened are written)
+and the last line holds a summary of the finished session so a replay
+can check it ended up in exactly the same place.
+
+Background jobs finishing are recorded too, by job number, and a replay
+waits for each job to hand it over in the same poll. Recordings made
+before jobs were recorded get every job handed over at the next poll,
+as if it had run straight away.
+
+Recorded and replayed sessions keep the inventions they sell in a
+throwaway store rather than the player's history, so both start from
+the same empty gallery and neither adds to the history.
+"""
+
+# Keys the screens poll with pygame.key.get_pressed().
+WATCHED_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_BACKSPACE, pygame.K_LSHIFT, pygame.K_RSHIFT)
+
+# Event types the screens react to, and the attributes worth keeping.
+RECORDED_EVENTS = (
+    pygame.QUIT,
+    pygame.MOUSEBUTTONDOWN,
+    pygame.MOUSEBUTTONUP,
+    pygame.MOUSEMOTION,
+    pygame.KEYDOWN,
+    pygame.KEYUP,
+)
+EVENT_ATTRS = ('pos', 'rel', 'button', 'buttons', 'key', 'mod', 'unicode', 'scancode')
+
+_event_get = pygame.event.get
+_mouse_get_pos = pygame.mouse.get_pos
+_key_get_pressed = pygame.key.get_pressed
+
+
+class ReplayFinished(Exception):
+    """Raised when a replay runs out of recorded input.
+    """
+
+
+class ReplayDiverged(Exception):
+    """Raised when a replay hands over a job the recording finished but
+    the replay never submitted, so it can't carry on in step.
+    """
+
+
+class PressedKeys(object):
+    """Stand-in for the sequence pygame.key.get_pressed() returns.
+    """
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+class UncappedClock(object):
+    """Wraps a pygame Clock so tick() never sleeps, whatever fps the
+    screens ask for.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def tick(self, framerate=0, busy=False):
+        return self.clock.tick()
+
+    async def tick_async(self, framerate=0, busy=False):
+        await end_frame()
+        return self.clock.tick()
+
+    def get_fps(self):
+        return self.clock.get_fps()
+
+
+def serialise_event(event):
+    if event.type == JOB_DONE:
+        return {'job': event.job}
+    attrs = {}
+    for name in EVENT_ATTRS:
+        if hasattr(event, name):
+            value = getattr(event, name)
+            attrs[name] = list(value) if isinstance(value, tuple) else value
+    return {'type': event.type, 'attrs': attrs}
+
+def deserialise_event(entry):
+    if 'job' in entry:
+        event = job_event(entry.get('job'))
+        if event is None:
+            raise ReplayDiverged('the recording finishes job {0}, which this replay never submitted'.format(entry.get('job')))
+        return event
+    attrs = {}
+    for name, value in entry.get('attrs').items():
+        attrs[name] = tuple(value) if isinstance(value, list) else value
+    return pygame.event.Event(entry.get('type'), attrs)
+
+def open_session_store():
+    """Points the invention store at a new temporary directory and
+    returns it.
+    """
+    # Imported here so sqlite3 isn't loaded at startup when nothing is
+    # being recorded.
+    from invention_store import use_store
+
+    path = tempfile.mkdtemp(prefix='spork-session-')
+    use_store(path)
+    return path
+
+def session_summary(game_state):
+    """Returns the parts of the game state a replay must reproduce: the
+    funds and a hash of the pixels of every built invention.
+    """
+    built = []
+    for entry in game_state.get('built_sprites'):
+        wait_for_save(entry.get('img'))
+        img = pygame.image.load(entry.get('img'))
+        pixels = pygame.image.tostring(img, 'RGBA')
+        built.append({
+            'name': entry.get('name'),
+            'size': list(img.get_size()),
+            'sha1': hashlib.sha1(pixels).hexdigest(),
+        })
+
+    return {
+        'available_funds': game_state.get('available_funds'),
+        'built_sprites': built,
+    }
+
+
+class SessionRecorder(object):
+    """Records every event, the mouse position and the watched keys
+    each time the game polls for events.
+
+    The mouse position and pressed keys are snapshotted when events are
+    polled and served from that snapshot until the next poll, so the
+    game sees exactly the same input while recording as it will while
+    replaying.
+    """
+
+    def __init__(self, path, seed=None):
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        self.file = open(path, 'w')
+        self.call = 0
+        self.mouse = (0, 0)
+        self.keys = PressedKeys([])
+        self.write({'seed': seed, 'jobs': True})
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+
+    def install(self, game_state):
+        random.seed(self.seed)
+        self.store = open_session_store()
+        pygame.event.get = self.event_get
+        pygame.mouse.get_pos = self.mouse_get_pos
+        pygame.key.get_pressed = self.key_get_pressed
+        return game_state
+
+    def event_get(self, *args, **kwargs):
+        events = _event_get(*args, **kwargs)
+        mouse = tuple(_mouse_get_pos())
+        real_keys = _key_get_pressed()
+        keys = [key for key in WATCHED_KEYS if real_keys[key]]
+
+        entry = {}
+        recorded = [e for e in events if e.type in RECORDED_EVENTS or e.type == JOB_DONE]
+        if recorded:
+            entry['events'] = [serialise_event(e) for e in recorded]
+        if mouse != self.mouse:
+            entry['mouse'] = list(mouse)
+        if set(keys) != self.keys.keys:
+            entry['keys'] = keys
+
+        if entry:
+            entry['call'] = self.call
+            entry['t'] = pygame.time.get_ticks()
+            self.write(entry)
+
+        self.call += 1
+        self.mouse = mouse
+        self.keys = PressedKeys(keys)
+        # The screens don't react to the rest, so they pass through
+        # unrecorded.
+        return events
+
+    def mouse_get_pos(self):
+        return self.mouse
+
+    def key_get_pressed(self):
+        return self.keys
+
+    def finish(self, game_state):
+        self.write({'summary': session_summary(game_state)})
+        return True
+
+    def close(self):
+        """Closes the recording, whether or not the session finished.
+        """
+        self.file.close()
+        shutil.rmtree(self.store, ignore_errors=True)
+
+
+class SessionReplayer(object):
+    """Feeds a recorded session back into the game in place of real
+    input.
+    """
+
+    def __init__(self, path):
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+
+        self.seed = lines[0].get('seed')
+        self.recorded_jobs = lines[0].get('jobs', False)
+        self.summary = None
+        self.entries = {}
+        for entry in lines[1:]:
+            if 'summary' in entry:
+                self.summary = entry.get('summary')
+            else:
+                self.entries[entry.get('call')] = entry
+        self.last_call = max(self.entries) if self.entries else -1
+        self.call = 0
+        self.mouse = (0, 0)
+        self.keys = PressedKeys([])
+
+    def install(self, game_state):
+        random.seed(self.seed)
+        self.store = open_session_store()
+        pygame.event.get = self.event_get
+        pygame.mouse.get_pos = self.mouse_get_pos
+        pygame.key.get_pressed = self.key_get_pressed
+        pygame.mouse.set_cursor = self.mouse_set_cursor
+        game_state.update({'clock': UncappedClock(game_state.get('clock'))})
+        return game_state
+
+    def event_get(self, *args, **kwargs):
+        # Keep the OS happy, but the real events are discarded.
+        _event_get()
+
+        if self.call > self.last_call:
+            raise ReplayFinished()
+
+        entry = self.entries.get(self.call, {})
+        self.call += 1
+
+        if 'mouse' in entry:
+            self.mouse = tuple(entry.get('mouse'))
+        if 'keys' in entry:
+            self.keys = PressedKeys(entry.get('keys'))
+        events = [deserialise_event(e) for e in entry.get('events', [])]
+        if not self.recorded_jobs:
+            events.extend(job_event(job) for job in sorted(pending))
+        return events
+
+    def mouse_get_pos(self):
+        return self.mouse
+
+    def mouse_set_cursor(self, *args, **kwargs):
+        # The dummy video driver has no cursor to change.
+        pass
+
+    def key_get_pressed(self):
+        return self.keys
+
+    def finish(self, game_state):
+        """Compares the replayed session with the recorded summary and
+        reports the outcome. Returns True if they match.
+        """
+        if self.summary is None:
+            print('Replay finished, recording has no summary to check.')
+            return True
+
+        summary = session_summary(game_state)
+        if summary == self.summary:
+            print('Replay matches recording after {0} input polls.'.format(self.call))
+            return True
+
+        print('Replay does NOT match recording.')
+        print('  recorded: ' + json.dumps(self.summary))
+        print('  replayed: ' + json.dumps(summary))
+        return False
+
+    def close(self):
+        shutil.rmtree(self.store, ignore_errors=True)
@@ -0,0 +1,154 @@
+import pygame
+import numpy
+
+from image_cache import load_image
+
+"""This module scores a spliced invention by looking at the pixels of
+the finished composite, so the reviews reflect what was actually built.
+
+Every measure is worked out on alpha masks with vectorised numpy
+operations. The masks are sampled on every other pixel in each
+direction, which keeps a full splice canvas to a few milliseconds and
+makes no difference to the statistics.
+"""
+
+# Alpha values above this count as part of the invention.
+ALPHA_THRESHOLD = 16
+
+# Sample every n-th pixel in each direction.
+SAMPLE_STEP = 2
+
+# How much each measure contributes to the final 0 - 10 score.
+WEIGHTS = {
+    'coverage': 0.2,
+    'overlap': 0.3,
+    'balance': 0.25,
+    'survival': 0.25,
+}
+
+# Opaque pixel counts of the full component images, keyed by path.
+source_pixel_counts = {}
+
+
+def alpha_mask(surface):
+    """Returns a boolean (x, y) array of the sampled opaque pixels of
+    'surface'.
+    """
+    # Work on a view of the surface's alpha rather than a copy.
+    alpha = pygame.surfarray.pixels_alpha(surface)
+    mask = alpha[::SAMPLE_STEP, ::SAMPLE_STEP] > ALPHA_THRESHOLD
+    del alpha
+    return mask
+
+def source_pixel_count(path):
+    """Number of opaque pixels in the uncropped image at 'path'.
+    """
+    if path not in source_pixel_counts:
+        img, offset = load_image(path)
+        count = numpy.count_nonzero(pygame.surfarray.array_alpha(img) > ALPHA_THRESHOLD)
+        source_pixel_counts[path] = int(count)
+    return source_pixel_counts[path]
+
+def coverage_measure(mask):
+    """Scores how much of the canvas the invention fills. Anything
+    between 15% and 50% is ideal, a speck or a solid wall is not.
+    """
+    coverage = numpy.count_nonzero(mask) / float(mask.size)
+    return float(numpy.clip(min(coverage / 0.15, (1.0 - coverage) / 0.5), 0.0, 1.0))
+
+def overlap_measure(mask1, mask2):
+    """Scores how well the two components are joined together. They
+    need to touch to count as a hybrid, but one mostly hiding the other
+    is no better than them being apart.
+    """
+    count1 = numpy.count_nonzero(mask1)
+    count2 = numpy.count_nonzero(mask2)
+    if not (count1 and count2):
+        return 0.0
+
+    overlap = numpy.count_nonzero(mask1 & mask2) / float(min(count1, count2))
+    if overlap <= 0.5:
+        return min(overlap / 0.1, 1.0)
+    return max(1.0 - ((overlap - 0.5) / 0.5), 0.0)
+
+def balance_measure(mask):
+    """Scores the left/right symmetry of the invention and how close its
+    centre of mass sits to the middle of its bounding box.
+    """
+    xs = numpy.flatnonzero(mask.any(axis=1))
+    ys = numpy.flatnonzero(mask.any(axis=0))
+    if not len(xs):
+        return 0.0
+
+    box = mask[xs[0]:xs[-1] + 1, ys[0]:ys[-1] + 1]
+    mirrored = box[::-1, :]
+    symmetry = numpy.count_nonzero(box & mirrored) / float(numpy.count_nonzero(box | mirrored))
+
+    box_w, box_h = box.shape
+    col_weights = box.sum(axis=1)
+    row_weights = box.sum(axis=0)
+    total = float(col_weights.sum())
+    centre_x = (col_weights * numpy.arange(box_w)).sum() / total
+    centre_y = (row_weights * numpy.arange(box_h)).sum() / total
+    offset_x = abs(centre_x - (box_w - 1) * 0.5) / max(box_w * 0.5, 1)
+    offset_y = abs(centre_y - (box_h - 1) * 0.5) / max(box_h * 0.5, 1)
+    centred = 1.0 - min(max(offset_x, offset_y), 1.0)
+
+    return float(0.5 * symmetry + 0.5 * centred)
+
+def sprite_survival(sprite, canvas_rect):
+    """Fraction of the sprite's full component that is still visible on
+    the canvas, after cropping and after anything hanging off the edge.
+    """
+    visible_rect = sprite.rect.clip(canvas_rect)
+    if not (visible_rect.w and visible_rect.h):
+        return 0.0
+
+    left = visible_rect.x - sprite.rect.x
+    top = visible_rect.y - sprite.rect.y
+    alpha = pygame.surfarray.pixels_alpha(sprite.image)
+    visible = alpha[left:left + visible_rect.w, top:top + visible_rect.h]
+    visible_count = numpy.count_nonzero(visible > ALPHA_THRESHOLD)
+    del alpha, visible
+
+    linear_scale = sprite.scale / 100.0
+    full_count = source_pixel_count(sprite.source) * linear_scale * linear_scale
+    if not full_count:
+        return 0.0
+    return float(min(visible_count / full_count, 1.0))
+
+def score_invention(canvas_surface, sprites):
+    """Scores the invention composited on 'canvas_surface' from the
+    sprite group 'sprites'.
+
+    Returns a dict holding each measure between 0 and 1 and an overall
+    'score' between 0 and 10.
+    """
+    size = canvas_surface.get_size()
+    canvas_rect = canvas_surface.get_rect()
+
+    # Draw each component on its own layer to see where they meet.
+    layers = {'1': pygame.Surface(size, pygame.SRCALPHA, 32),
+              '2': pygame.Surface(size, pygame.SRCALPHA, 32)}
+    survival = {'1': 0.0, '2': 0.0}
+    for sprite in sprites:
+        component = sprite.component
+        if component not in layers:
+            continue
+        layers[component].blit(sprite.image, sprite.rect)
+        survival[component] = max(survival[component], sprite_survival(sprite, canvas_rect))
+
+    mask = alpha_mask(canvas_surface)
+    measures = {
+        'coverage': coverage_measure(mask),
+        'overlap': overlap_measure(alpha_mask(layers['1']), alpha_mask(layers['2'])),
+        'balance': balance_measure(mask),
+        'survival': (survival['1'] + survival['2']) * 0.5,
+    }
+
+    score = 0.0
+    for name, weight in WEIGHTS.items():
+        score += weight * measures[name]
+    measures['score'] = round(10 * score, 2)
+
+    return measures
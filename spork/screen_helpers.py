@@ -1,5 +1,6 @@
 from sprites.base_sprites import ConfirmBox, ButtonImageSprite
 import pygame
+import telemetry
 
 def quit_game(game_state):
     """Stops the current screen and sets the quit flag so the main loop
@@ -22,12 +23,13 @@ def quit_game(game_state):
 
     game_state.update({'quit': True})
     game_state.update({'screen_done': True})
-    pygame.mixer.music.stop()
+    game_state.get('music').stop()
     return game_state
 
 def switch_to_screen(game_state, screen_name):
     """Transition from the current screen to another.
     """
+    telemetry.screen_switched(screen_name)
     game_state.update({'active_screen': screen_name})
     game_state.update({'screen_done': True})
     return game_state
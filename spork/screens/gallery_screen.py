@@ -0,0 +1,232 @@
+import pygame
+
+# Import helper functions.
+from screen_helpers import quit_game, switch_to_screen, notify
+from jobs import JOB_DONE, WORK_DONE, finish_job, finish_work
+from async_runner import start, submit_io, wait_io
+from image_cache import make_thumbnail, cached_thumbnail, store_thumbnail
+from invention_store import count_inventions, load_inventions, image_path
+
+# Import sprites.
+from sprites.base_sprites import ButtonSprite, button_at_point, TextSprite
+
+"""The gallery shows every invention ever sold, a page at a time.
+
+Only the page on show, and the page after it, are read from the
+invention index, and only their thumbnails are decoded, by background
+tasks on worker threads, into the bounded thumbnail cache. Each frame
+only draws one page, so the gallery runs just as smoothly with ten
+thousand inventions in the history as with ten.
+
+This screen runs on the asyncio event loop, see async_runner.
+"""
+
+COLUMNS = 4
+ROWS = 2
+PAGE_SIZE = COLUMNS * ROWS
+
+THUMBNAIL_SIZE = (200, 150)
+
+
+def gallery_thumbnail(path):
+    """Makes a gallery thumbnail on a worker thread, or None if the
+    image can't be read.
+    """
+    try:
+        return make_thumbnail(path, THUMBNAIL_SIZE)
+    except (pygame.error, OSError):
+        return None
+
+async def load_thumbnail(requested, path, done, job):
+    """Background task waiting for the thumbnail for 'path' to be
+    decoded, then putting it in the cache. Failed thumbnails are
+    remembered as None.
+    """
+    image = await wait_io(done, job)
+    if image is None:
+        requested[path] = None
+        return
+    store_thumbnail(path, THUMBNAIL_SIZE, image)
+    del requested[path]
+
+def request_thumbnail(requested, path):
+    """Starts loading the thumbnail for 'path' unless it's cached or
+    already on its way.
+    """
+    if path in requested or cached_thumbnail(path, THUMBNAIL_SIZE):
+        return
+    done, job = submit_io(gallery_thumbnail, path)
+    requested[path] = (start(load_thumbnail(requested, path, done, job)), job)
+
+def cancel_thumbnails(requested, keep=()):
+    """Cancels loading every thumbnail not in 'keep'. The job is
+    cancelled as well as its task, as a cancelled task only stops the
+    next time the event loop runs, which may not be until the next
+    screen has finished.
+    """
+    for path, loading in list(requested.items()):
+        if loading is not None and path not in keep:
+            task, job = loading
+            task.cancel()
+            job.cancel()
+            del requested[path]
+
+def show_page(gallery, page):
+    """Moves to 'page', asks for its thumbnails then the next page's, and
+    cancels loading anything further away.
+    """
+    last_page = max((gallery.get('count') - 1) // PAGE_SIZE, 0)
+    page = min(max(page, 0), last_page)
+    records = load_inventions(page * PAGE_SIZE, 2 * PAGE_SIZE)
+    gallery.update({'page': page, 'last_page': last_page, 'records': records})
+
+    wanted = [image_path(record) for record in records]
+    requested = gallery.get('requested')
+    cancel_thumbnails(requested, wanted)
+    for path in wanted:
+        request_thumbnail(requested, path)
+
+    gallery.update({'cells': page_cells(gallery)})
+    return gallery
+
+def page_cells(gallery):
+    """Lays out the inventions on the current page, rendering their
+    captions once rather than every frame.
+    """
+    font = gallery.get('font')
+    screen_width, screen_height = gallery.get('screen_size')
+    cell_w = screen_width * 0.2
+    cell_h = screen_height * 0.36
+    left = (screen_width - (cell_w * COLUMNS)) * 0.5
+    top = screen_height * 0.14
+
+    cells = []
+    for i, record in enumerate(gallery.get('records')[:PAGE_SIZE]):
+        x = left + (i % COLUMNS) * cell_w
+        y = top + (i // COLUMNS) * cell_h
+        score = record.get('score') or {}
+        cells.append({
+            'path': image_path(record),
+            'rect': pygame.Rect(x + 10, y, THUMBNAIL_SIZE[0], THUMBNAIL_SIZE[1]),
+            'name': font.render(record.get('name'), True, (0, 0, 0)),
+            'details': font.render('{0} - {1}/10 - £{2:.2f}'.format(
+                record.get('company'), score.get('score', 0), record.get('earnings', 0)), True, (60, 60, 60)),
+        })
+    return cells
+
+def draw_cell(game_surface, gallery, cell):
+    rect = cell.get('rect')
+    pygame.draw.rect(game_surface, (230, 230, 230), rect)
+
+    thumbnail = cached_thumbnail(cell.get('path'), THUMBNAIL_SIZE)
+    if thumbnail:
+        game_surface.blit(thumbnail, thumbnail.get_rect(center=rect.center))
+    elif cell.get('path') in gallery.get('requested') and gallery.get('requested')[cell.get('path')] is None:
+        missing = gallery.get('font').render('Missing', True, (120, 120, 120))
+        game_surface.blit(missing, missing.get_rect(center=rect.center))
+    else:
+        # Still on its way, it is asked for again in case the cache
+        # dropped it.
+        request_thumbnail(gallery.get('requested'), cell.get('path'))
+
+    pygame.draw.rect(game_surface, (50, 50, 50), rect, 2)
+    game_surface.blit(cell.get('name'), (rect.x, rect.bottom + 5))
+    game_surface.blit(cell.get('details'), (rect.x, rect.bottom + 25))
+
+async def gallery_loop(game_state):
+    """The gallery screen loop.
+    """
+
+    game_surface = game_state.get('game_surface')
+    clock = game_state.get('clock')
+    fps = game_state.get('fps')
+    click = game_state.get('click_sound')
+    screen_size = game_state.get('screen_size')
+    screen_width = screen_size[0]
+    screen_height = screen_size[1]
+
+    toast_stack = game_state.get('toast_stack')
+
+    gallery = {
+        'count': count_inventions(),
+        'requested': {},
+        'font': pygame.font.SysFont(None, 25),
+        'screen_size': screen_size,
+    }
+    gallery = show_page(gallery, 0)
+
+    all_sprites = pygame.sprite.OrderedUpdates()
+    all_sprites.add(
+        ButtonSprite(screen_width * 0.05, screen_height * 0.05, 'Back', switch_to_screen, ['main_menu_screen']),
+        ButtonSprite(screen_width * 0.35, screen_height * 0.92, 'Prev', lambda game_state: game_state, []),
+        ButtonSprite(screen_width * 0.57, screen_height * 0.92, 'Next', lambda game_state: game_state, []),
+    )
+    prev_button, next_button = all_sprites.sprites()[1:]
+
+    title = TextSprite(screen_width * 0.4, screen_height * 0.04, 400, 50, 'Hall of Inventions', arcade_font=True)
+    all_sprites.add(title)
+
+    if not gallery.get('count'):
+        notify(game_state, 'warn', 'Nothing has been invented yet.')
+
+    while not game_state.get('screen_done'):
+        page = gallery.get('page')
+
+        # Handle events.
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                quit_game(game_state)
+
+            elif event.type == JOB_DONE:
+                finish_job(event)
+
+            elif event.type == WORK_DONE:
+                finish_work(event)
+
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 4:
+                    page -= 1
+                elif event.button == 5:
+                    page += 1
+                elif event.button == 1:
+                    b = button_at_point(all_sprites, event.pos)
+                    if b is prev_button:
+                        page -= 1
+                    elif b is next_button:
+                        page += 1
+                    if b:
+                        click.play()
+                        game_state = b.on_click(game_state)
+
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_LEFT:
+                    page -= 1
+                elif event.key == pygame.K_RIGHT:
+                    page += 1
+
+        if page != gallery.get('page'):
+            gallery = show_page(gallery, page)
+
+        # Update.
+        toast_stack.update()
+
+        # Display.
+        game_surface.fill((180, 160, 120))
+        all_sprites.draw(game_surface)
+        for cell in gallery.get('cells'):
+            draw_cell(game_surface, gallery, cell)
+
+        page_text = gallery.get('font').render(
+            'Page {0} of {1}'.format(gallery.get('page') + 1, gallery.get('last_page') + 1), True, (0, 0, 0))
+        game_surface.blit(page_text, page_text.get_rect(center=(screen_width * 0.5, screen_height * 0.935)))
+
+        toast_stack.draw(game_surface)
+
+        pygame.display.update()
+
+        # Keep going at full speed while thumbnails are still landing.
+        loading = any(loading is not None for loading in gallery.get('requested').values())
+        await clock.tick_async(fps, busy=loading or len(toast_stack))
+
+    cancel_thumbnails(gallery.get('requested'))
+    return game_state
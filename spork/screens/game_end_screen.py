@@ -3,15 +3,11 @@ import pygame, os
 # Import helper functions.
 from helpers import top_draggable_sprite_at_point, aspect_scale, draw_rects
 from screen_helpers import quit_game, switch_to_screen, notify
+from jobs import JOB_DONE, WORK_DONE, finish_job, finish_work
 
 # Import sprites.
 from sprites.base_sprites import ImageSprite, ButtonSprite, button_at_point, ThumbnailSprite, TextSprite
 
-pygame.mixer.pre_init(22050, -16, 2, 1024)
-pygame.init()
-pygame.mixer.quit() # Hack to stop sound lagging.
-pygame.mixer.init(22050, -16, 2, 1024)
-
 
 # Main group of sprites to display.
 general_sprites = pygame.sprite.OrderedUpdates()
@@ -77,6 +73,12 @@ def game_end_loop(game_state):
             if event.type == pygame.QUIT:
                 quit_game(game_state)
 
+            elif event.type == JOB_DONE:
+                finish_job(event)
+
+            elif event.type == WORK_DONE:
+                finish_work(event)
+
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 
                 if (event.button == 1):
@@ -112,6 +114,6 @@ def game_end_loop(game_state):
 
         pygame.display.update()
 
-        clock.tick(60)
+        clock.tick(60, busy=len(toast_stack))
 
     return game_state
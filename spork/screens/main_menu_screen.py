@@ -3,15 +3,13 @@ import pygame, os, random, string
 # Import helper functions.
 from helpers import top_draggable_sprite_at_point, aspect_scale, draw_rects
 from screen_helpers import quit_game, switch_to_screen, notify
+from jobs import JOB_DONE, WORK_DONE, finish_job, finish_work
+from startup import first_frame
+from adaptive_clock import blink_on
 
 # Import sprites.
 from sprites.base_sprites import ImageSprite, ButtonSprite, InputBox, button_at_point, TextSprite
 
-pygame.mixer.pre_init(22050, -16, 2, 1024)
-pygame.init()
-pygame.mixer.quit() # Hack to stop sound lagging.
-pygame.mixer.init(22050, -16, 2, 1024)
-
 def start_game(game_state):
     game_state.update({
         'active_music': 'Komiku_School.mp3',
@@ -30,9 +28,12 @@ def main_menu_loop(game_state):
     screen_size = game_state.get('screen_size')
     screen_width = screen_size[0]
     screen_height = screen_size[1]
-    framecount = 1
 
     toast_stack = game_state.get('toast_stack')
+
+    # Decode the workshop's music now, so starting the game doesn't wait.
+    game_state.get('music').preload('Komiku_School.mp3')
+
     logo_sprites = pygame.sprite.OrderedUpdates()
     logo = ImageSprite(
             screen_width*0.315,
@@ -69,6 +70,13 @@ def main_menu_loop(game_state):
             'Play!',
             start_game,
             []),
+        ButtonSprite(
+            (screen_width * 0.455),
+            (screen_height * 0.85),
+            'Gallery',
+            switch_to_screen,
+            ['gallery_screen'],
+        ),
         ButtonSprite(
             (screen_width * 0.455),
             (screen_height * 0.9),
@@ -91,6 +99,12 @@ def main_menu_loop(game_state):
             if event.type == pygame.QUIT:
                 quit_game(game_state)
 
+            elif event.type == JOB_DONE:
+                finish_job(event)
+
+            elif event.type == WORK_DONE:
+                finish_work(event)
+
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 b = button_at_point(all_sprites, event.pos)
                 if b:
@@ -119,16 +133,12 @@ def main_menu_loop(game_state):
 
         
 
-        if framecount <= (fps/2):
-            framecount += 1
-        elif framecount < fps and framecount > (fps/2):
-            framecount += 1
+        if blink_on():
             name_prompt.draw(game_surface)
-        elif framecount >= fps:
-            framecount =1
 
         pygame.display.update()
+        first_frame()
 
-        clock.tick(fps)
+        clock.tick(fps, busy=len(toast_stack))
 
     return game_state
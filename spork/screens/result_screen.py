@@ -3,15 +3,13 @@ import pygame, os, random
 # Import helper functions.
 from helpers import top_draggable_sprite_at_point, aspect_scale, draw_rects
 from screen_helpers import quit_game, switch_to_screen, notify
+from jobs import JOB_DONE, WORK_DONE, submit, finish_job, finish_work
+from sound_cache import load_sound
+from invention_store import add_invention
 
 # Import sprites.
 from sprites.base_sprites import BaseSprite, ImageSprite, ButtonSprite, button_at_point, TextSprite
 
-pygame.mixer.pre_init(22050, -16, 2, 1024)
-pygame.init()
-pygame.mixer.quit() # Hack to stop sound lagging.
-pygame.mixer.init(22050, -16, 2, 1024)
-
 tagline_templates = [
     "This week {0} released it's latest product: the {1}.",
 
@@ -93,6 +91,22 @@ review_templates = {
     },
 }
 
+sale_prices = {
+    'good': (15.0, 20.0),
+    'medium': (10.0, 15.0),
+    'bad': (1.0, 6.0),
+    'very_bad': (0.01, 3.0),
+}
+
+def get_review_type(score):
+    """Returns the review type whose score range holds the invention's
+    score.
+    """
+    rounded_score = int(round(score))
+    for review_type, review in review_templates.items():
+        if review.get('min_score') <= rounded_score <= review.get('max_score'):
+            return review_type
+
 def get_reviews(review_type):
 
     template_options = review_templates.get(review_type).get('templates')
@@ -113,6 +127,10 @@ def get_reviews(review_type):
 
 class NewspaperSprite(BaseSprite):
     """This sprite contains the reviews of the product.
+
+    The text is rendered on the main thread, as fonts are shared with
+    everything else drawn there, then the newspaper is put together on
+    a worker thread. It starts spinning in once it's ready.
     """
 
     def __init__(self, x, y, img_path, w, h, company, product):
@@ -127,86 +145,92 @@ class NewspaperSprite(BaseSprite):
         self.font = pygame.font.SysFont(None, 25)
         self.title_font = pygame.font.SysFont(None, 40)
         self.text_color = (0, 0, 0)
-        self.review_type = None
+        self.original_image = None
+
+        # Choose a type of review based on how good the invention is.
+        # Everything random is picked here so it comes out the same
+        # whenever the worker gets to it.
+        self.review_type = get_review_type(self.product.get('score').get('score'))
+        self.tagline_template = random.choice(tagline_templates)
+        self.reviews = get_reviews(self.review_type)
+        self.render_text()
 
         # Call the parent constructor
         super(NewspaperSprite, self).__init__(x, y)
 
-    def init_image(self):
-        self.image = pygame.Surface((self.w, self.h))
-        self.image.fill((150, 150, 150))
-
-        loaded_img = pygame.image.load(self.img_path)
-        self.image.blit(loaded_img, (0, 0))
-
+    def render_text(self):
+        """Renders the title, tagline and reviews for build_image().
+        """
         name = self.product.get('name')
+        self.title = self.title_font.render(name, True, self.text_color)
 
-        # Display the article title.
-        title = self.title_font.render(name, True, self.text_color)
-        pos = ((self.w * 0.25) - (title.get_size()[0] * 0.5), (self.h * 0.2))
-        self.image.blit(title, pos)
-
-        # Generate a tagline.
-        tagline_template = random.choice(tagline_templates)
-        tagline_text = tagline_template.format(self.company, name)
-        tagline_text_box = TextSprite(
+        tagline_text = self.tagline_template.format(self.company, name)
+        self.tagline = TextSprite(
             self.x,
             self.y,
             (self.w * 0.6),
             (self.h * 0.9),
             tagline_text
-        )
-        self.image.blit(
-            tagline_text_box.image,
+        ).image
+
+        # The reviews with their scores.
+        self.review_images = []
+        for review in self.reviews:
+            score = review.get('score')
+            text = review.get('text') + '  ' + str(score) + '/10'
+            self.review_images.append(TextSprite(
+                self.x,
+                self.y,
+                (self.w * 0.5),
+                (self.h * 0.5),
+                text
+            ).image)
+
+    def init_image(self):
+        self.image = pygame.Surface((1, 1), pygame.SRCALPHA, 32)
+        submit(self.build_image, on_done=self.image_ready)
+
+    def build_image(self):
+        """Puts the newspaper together from the rendered text, runs on a
+        worker thread.
+        """
+        image = pygame.Surface((self.w, self.h))
+        image.fill((150, 150, 150))
+
+        loaded_img = pygame.image.load(self.img_path)
+        image.blit(loaded_img, (0, 0))
+
+        # Display the article title.
+        pos = ((self.w * 0.25) - (self.title.get_size()[0] * 0.5), (self.h * 0.2))
+        image.blit(self.title, pos)
+
+        # Display the tagline.
+        image.blit(
+            self.tagline,
             ((self.w * 0.05), (self.h * 0.3))
         )
 
         # Display the product image
         product_image = ImageSprite(0, 0, self.product.get('img'))
         scaled_image = aspect_scale(product_image.image, ((self.w * 0.4), (self.h * 0.4)))
-        self.image.blit(scaled_image, ((self.w * 0.65) , (self.h * 0.3)))
+        image.blit(scaled_image, ((self.w * 0.65) , (self.h * 0.3)))
         scaled_w, scaled_h = scaled_image.get_size()
         box_rect = pygame.Rect((self.w * 0.65) , (self.h * 0.3), scaled_w, scaled_h)
-        pygame.draw.rect(self.image, (50,50,50), box_rect, 2)
-
-        # Choose a type of review
-        # suuuper quick hacky way of percentage choices
-        choice_list = [
-            'good',
-            'good',
-            'good',
-            'medium',
-            'medium',
-            'medium',
-            'medium',
-            'medium',
-            'bad',
-        ]
-        review_type = random.choice(choice_list)
-        if (random.random() < 0.05):
-            review_type = 'very_bad'
-        self.review_type = review_type
-        
-        # Display the reviews with their scores.
-        reviews = get_reviews(review_type)
+        pygame.draw.rect(image, (50,50,50), box_rect, 2)
+
+        # Display the reviews.
         y_offset = self.h * 0.45 
-        for review in reviews:
-            score = review.get('score')
-            text = review.get('text') + '  ' + str(score) + '/10'
-            review_text_box = TextSprite(
-                self.x,
-                self.y,
-                (self.w * 0.5),
-                (self.h * 0.5),
-                text
-            )
-            self.image.blit(review_text_box.image, ((self.w * 0.075), y_offset))
+        for review_image in self.review_images:
+            image.blit(review_image, ((self.w * 0.075), y_offset))
             y_offset += 50
 
-        self.original_image = self.image
+        return image
+
+    def image_ready(self, image):
+        self.original_image = image
         self.original_scale = (self.w, self.h)
         self.current_modifier = 0.004
-        self.image = pygame.transform.scale(self.image, self.get_current_scale())
+        self.image = pygame.transform.scale(self.original_image, self.get_current_scale())
 
     def get_current_scale(self):
         return (
@@ -230,6 +254,8 @@ class NewspaperSprite(BaseSprite):
         """Increment the current scale modifier, then set the image to a
         scaled version of the image.
         """
+        if self.original_image is None:
+            return
         if (self.current_modifier < 1.0):
             self.current_modifier += 0.015
             self.image = pygame.transform.rotozoom(
@@ -257,7 +283,7 @@ class MoneySprite(BaseSprite):
         self.font = pygame.font.SysFont(None, 30)
         self.text_color = (25, 180, 20)
         self.channel = pygame.mixer.Channel(0)
-        self.coin_sound = pygame.mixer.Sound(os.getcwd() + '/data/sounds/get_coin.wav')
+        self.coin_sound = load_sound(os.getcwd() + '/data/sounds/get_coin.wav')
 
         # Call the parent constructor.
         super(MoneySprite, self).__init__(x, y)
@@ -278,14 +304,16 @@ class MoneySprite(BaseSprite):
             self.done = True
 
 def sell(product, review_type):
-    if review_type == 'good':
-        return round(random.uniform(15.0, 20.0), 2)
-    elif review_type == 'medium':
-        return round(random.uniform(10.0, 15.0), 2)
-    elif review_type == 'bad':
-        return round(random.uniform(1.0, 6.0), 2)
-    elif review_type == 'very_bad':
-        return round(random.uniform(0.01, 3.0), 2)
+    """Works out the profit on a product. Better scores within a review
+    type sell for more.
+    """
+    min_price, max_price = sale_prices.get(review_type)
+    min_score = review_templates.get(review_type).get('min_score') - 0.5
+    max_score = review_templates.get(review_type).get('max_score') + 0.5
+
+    score = product.get('score').get('score')
+    position = min(max((score - min_score) / (max_score - min_score), 0.0), 1.0)
+    return round(min_price + (max_price - min_price) * position, 2)
 
 def result_loop(game_state):
     """The result screen loop.
@@ -324,6 +352,7 @@ def result_loop(game_state):
     # Money counter, gets added after newspaper is done.
     available_funds = game_state.get('available_funds')
     profit = sell(product, newspaper.review_type)
+    add_invention(product, company, profit)
     game_state.update({'available_funds': available_funds + profit})
     money = MoneySprite(
         (screen_width * 0.5),
@@ -350,6 +379,12 @@ def result_loop(game_state):
             if event.type == pygame.QUIT:
                 quit_game(game_state)
 
+            elif event.type == JOB_DONE:
+                finish_job(event)
+
+            elif event.type == WORK_DONE:
+                finish_work(event)
+
             elif event.type == pygame.MOUSEBUTTONDOWN:                
                 b = button_at_point(all_sprites, event.pos)
                 if b:
@@ -375,6 +410,7 @@ def result_loop(game_state):
 
         toast_stack.draw(game_surface)
 
-        clock.tick(fps)
+        animating = not (newspaper.done and money.done)
+        clock.tick(fps, busy=animating or len(toast_stack))
 
     return game_state
@@ -1,26 +1,44 @@
-import pygame, os, random
+import pygame, os, random, time, itertools
 
 # Import helper functions.
 from helpers import top_draggable_sprite_at_point, aspect_scale, draw_rects
 from screen_helpers import quit_game, switch_to_screen, notify
+from splice_history import SpliceHistory
+from sound_cache import load_sound
+from telemetry import timing
+from pil_bridge import surface_image, image_surface
+from image_cache import add_image, remove_image
+from jobs import JOB_DONE, WORK_DONE, finish_job, finish_work
 
 #import crop module
-from crop import *
+from crop import setup, cropLoop
 # Import sprites.
-from sprites.base_sprites import ImageSprite, ButtonSprite, InputBox, button_at_point, ThumbnailSprite, ButtonImageSprite, ConfirmBox, TextSprite
-
-pygame.init()
+from sprites.base_sprites import ImageSprite, ButtonSprite, InputBox, button_at_point, ThumbnailSprite, ButtonImageSprite, ConfirmBox, TextSprite, FlattenedOrderedUpdates
 
 white= (255,255,255)
 black= (0,0,0)
 red = (255,0 ,0, 0)
 brown = (139,69,19)
 dark_brown= (111,54,10)
-splice_sprites = pygame.sprite.OrderedUpdates()
+splice_sprites = FlattenedOrderedUpdates()
 control_sprites = pygame.sprite.OrderedUpdates()
 splice_thumb1 = pygame.sprite.Group()
 splice_thumb2 = pygame.sprite.Group()
 
+# Scale factor applied to a multi-sprite selection each frame an arrow
+# key is held.
+GROUP_SCALE_STEP = 1.02
+
+# The help pop-up, drawn once, keyed by screen size.
+help_overlays = {}
+
+# Names for cropped images, which only exist in memory.
+crop_numbers = itertools.count()
+
+# Names of the crops made during this visit to the splicer. Undo can
+# bring any of them back, so they're kept until the splicer is left.
+crop_names = []
+
 
 def load_buttons(game_state, splice_canvas, confirm_splice, confirm_crop):
     x = game_state.get('screen_size')[0]
@@ -58,10 +76,8 @@ def load_buttons(game_state, splice_canvas, confirm_splice, confirm_crop):
     return game_state
 
 def switch_to_workshop(game_state):
-    game_state.update({'active_screen': 'workshop_screen'})
-    game_state.update({'screen_done': True})
     pygame.mouse.set_cursor(*pygame.cursors.arrow)
-    return game_state
+    return switch_to_screen(game_state, 'workshop_screen')
 
 def load_help_sprites(game_state):
     thumbsize = 80
@@ -133,13 +149,24 @@ def load_help_sprites(game_state):
 
     return help_sprites
 
-def open_help(game_state, help_sprites):
-    display_width = game_state.get('screen_size')[0]
-    display_height = game_state.get('screen_size')[1]
-    game_surface = game_state.get('game_surface')
-    pygame.draw.rect(game_surface, (200,100, 200), (0.365*display_width, 0.06*display_height, 0.605*display_width, 0.88*display_height))
-
-    help_sprites.draw(game_surface)
+def help_overlay(game_state):
+    """Returns the help pop-up drawn onto a single surface, and its rect.
+    It is only drawn the first time help is opened at each screen size.
+    """
+    screen_size = game_state.get('screen_size')
+    if screen_size not in help_overlays:
+        display_width, display_height = screen_size
+        rect = pygame.Rect(0.365*display_width, 0.06*display_height, 0.605*display_width, 0.88*display_height)
+        overlay = pygame.Surface(rect.size)
+        overlay.fill((200,100, 200))
+        for sprite in load_help_sprites(game_state):
+            overlay.blit(sprite.image, sprite.rect.move(-rect.x, -rect.y))
+        help_overlays[screen_size] = (overlay, rect)
+    return help_overlays[screen_size]
+
+def open_help(game_state):
+    overlay, rect = help_overlay(game_state)
+    game_state.get('game_surface').blit(overlay, rect)
     return game_state
 
 def toggle_help(game_state):
@@ -194,6 +221,7 @@ def add_sprite(game_state, num, mirror = False):
     else:
         return game_state
     tempsprite = ImageSprite(location_x, (0.5 * splice_canvas.h), game_state.get('active_sprite' + num))
+    tempsprite.component = num
     
     if mirror == True:
         tempsprite.image = pygame.transform.flip(tempsprite.image, True, False)
@@ -206,10 +234,16 @@ def add_sprite(game_state, num, mirror = False):
     tempsprite.rect.center = (location_x, (0.5 * splice_canvas.h))
     tempsprite.update_sprite()
        
-    splice_sprites.add(tempsprite)
+    game_state.get('splice_history').add(tempsprite)
     return game_state
 
 def screenshot(game_state, splice_canvas, confirm_splice):
+    # Imported here, they're only needed once something is spliced and
+    # bring in sqlite3 and numpy.
+    from compositing import composite
+    from scoring import score_invention
+    from invention_store import store_image
+    from export import export_invention
 
     new_name = game_state.get('new_sprite_name')
     if not new_name:
@@ -232,24 +266,39 @@ def screenshot(game_state, splice_canvas, confirm_splice):
         'sellotape_001.wav',
         'sellotape_002.wav',
     ])
-    sellotape_sound = pygame.mixer.Sound(os.getcwd() + '/data/sounds/sellotape/' + sound_file)
+    sellotape_sound = load_sound(os.getcwd() + '/data/sounds/sellotape/' + sound_file)
     channel = pygame.mixer.Channel(0)
     channel.play(sellotape_sound)
+    started = time.perf_counter()
     
     display_width = game_state.get('screen_size')[0]
     display_height = game_state.get('screen_size')[1]
 
-    transparent_surface = pygame.Surface((display_width, display_height), pygame.SRCALPHA, 32)
-    splice_canvas_surface = pygame.Surface((splice_canvas.w, splice_canvas.h), pygame.SRCALPHA, 32)
-    splice_sprites.draw(splice_canvas_surface)
-    transparent_surface.blit(splice_canvas_surface, (splice_canvas.x, splice_canvas.y))
-    sub = transparent_surface.subsurface(splice_canvas)
+    # Save the smooth version of every sprite, not whatever preview is
+    # showing right now.
+    for sprite in splice_sprites:
+        if not sprite.smooth:
+            sprite.use_smooth_image(wait=True)
+
+    splice_canvas_surface = composite(splice_sprites, splice_canvas.size)
+    score = score_invention(splice_canvas_surface, splice_sprites)
+
+    # Encoded on a worker thread, anything loading it waits for it.
+    img_path = store_image(splice_canvas_surface)
 
-    pygame.image.save(sub, os.getcwd() + "/data/temp/" + new_name + ".png")
+    export_scale = game_state.get('export_scale')
+    if export_scale:
+        def exported(path):
+            if path:
+                notify(game_state, 'ok', 'Exported {0} at {1}x.'.format(new_name, export_scale))
+            else:
+                notify(game_state, 'error', 'Could not export {0}.'.format(new_name))
+        export_invention(splice_sprites, splice_canvas.size, img_path, export_scale, on_done=exported)
 
     sprite_entry = {
         'name': new_name, 
-        'sprite': ThumbnailSprite(1,1, os.getcwd() + "/data/temp/" + new_name + ".png", display_width*0.2, display_width*0.2)
+        'img': img_path,
+        'sprite': ThumbnailSprite(1,1, img_path, display_width*0.2, display_width*0.2, background=True)
     }
 
     x = game_state.get('built_sprites')
@@ -258,10 +307,12 @@ def screenshot(game_state, splice_canvas, confirm_splice):
 
     game_state.update({'latest_product': {
         'name': new_name,
-        'img': os.getcwd() + "/data/temp/" + new_name + ".png",
+        'img': img_path,
         'components': [game_state.get('active_sprite1'), game_state.get('active_sprite2')],
         'total_cost': 4000.3,
+        'score': score,
     }})
+    timing('splice', new_name, (time.perf_counter() - started) * 1000)
 
     # Wait for sellotape sound to finish.
     while channel.get_busy():
@@ -292,14 +343,22 @@ def crop(game_state, num, confirm_crop, mirror = False):
         confirm_crop.proceed == None
         confirm_crop.active = False
 
-    im = Image.open(game_state.get('active_sprite'+ num))
-    im = im.crop(( left-int(image_offset[0]), upper-int(image_offset[1]), right-int(image_offset[0]), lower-int(image_offset[1])))
-    im.save('outie.png')
+    # Cropped straight from the pixels on screen, each crop kept in
+    # memory under a name of its own.
+    started = time.perf_counter()
+    with surface_image(px) as im:
+        im = im.crop(( left-int(image_offset[0]), upper-int(image_offset[1]), right-int(image_offset[0]), lower-int(image_offset[1])))
+    crop_name = 'crop-{0}'.format(next(crop_numbers))
+    add_image(crop_name, image_surface(im))
+    crop_names.append(crop_name)
     display_width = 1200
     display_height = 675
     game_state.update({'game_surface': pygame.display.set_mode((display_width, display_height))})
-    crop_sprite = (ImageSprite(490, 263, os.getcwd()+ '/outie.png'))
-    splice_sprites.add(crop_sprite)
+    crop_sprite = (ImageSprite(490, 263, crop_name))
+    crop_sprite.source = game_state.get('active_sprite' + num)
+    crop_sprite.component = num
+    game_state.get('splice_history').add(crop_sprite)
+    timing('crop', crop_sprite.source, (time.perf_counter() - started) * 1000)
 
     return game_state
 
@@ -307,6 +366,20 @@ def get_relative_mouse_pos(pos):
     x, y = pygame.mouse.get_pos()
     return (x - pos[0], y - pos[1])
 
+def corner_rects(r):
+    """Small markers drawn on the corners of a selected sprite.
+    """
+    return [
+        pygame.Rect((r.x - 2), (r.y - 2), 10, 10),
+        pygame.Rect((r.x + r.w - 8), (r.y - 2), 10, 10), 
+        pygame.Rect((r.x + r.w - 8), (r.y + r.h - 8), 10, 10),
+        pygame.Rect((r.x - 2), (r.y + r.h - 8), 10, 10)
+    ]
+
+def shift_held():
+    keys = pygame.key.get_pressed()
+    return keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]
+
 def splicer_loop(game_state):
     """The splicer screen loop.
     """
@@ -352,6 +425,8 @@ def splicer_loop(game_state):
     toast_stack = game_state.get('toast_stack')
 
     splice_sprites.empty()
+    splice_history = SpliceHistory(splice_sprites)
+    game_state.update({'splice_history': splice_history})
     splice_thumb1.empty()
     splice_thumb2.empty()
     thumb1 = ThumbnailSprite(0.1*display_width, 0.2*display_height, active_sprite1, thumbnail_size[0], thumbnail_size[1] )
@@ -363,48 +438,48 @@ def splicer_loop(game_state):
 
     #make the thumbnails of your activesprites
 
-    help_sprites = load_help_sprites(game_state)
-    
-    #make sprites for the help pop-up
-
     load_buttons(game_state, splice_canvas, confirm_splice, confirm_crop)
     
     # Want to move these elsewhere/design them away.
     dragging = False
     dragged_sprite = None
-    selected = None
+    dragged_sprites = []
+
+    # Sprites locked with right click or shift click, or picked by
+    # dragging a band around them on an empty part of the canvas.
+    selection = []
+    band_start = None
+    band_rect = None
 
     while not game_state.get('screen_done'):
+        # Forget selected sprites which were deleted or undone away.
+        selection = [sprite for sprite in selection if sprite in splice_sprites]
+        for sprite in splice_sprites:
+            sprite.selected = sprite in selection
+
         if pygame.mouse.get_pos():
             s = top_draggable_sprite_at_point(splice_sprites, get_relative_mouse_pos((splice_canvas.x, splice_canvas.y)))
         else:
             s = None
-        if selected:
-            s= selected
-
-        if s:
-            hover_rects1 = [s.rect]
-            if s.selected == True:
-                r = s.rect
-                hover_rects2 = [
-                    pygame.Rect((r.x - 2), (r.y - 2), 10, 10),
-                    pygame.Rect((r.x + r.w - 8), (r.y - 2), 10, 10), 
-                    pygame.Rect((r.x + r.w - 8), (r.y + r.h - 8), 10, 10),
-                    pygame.Rect((r.x - 2), (r.y + r.h - 8), 10, 10)
-                ]
+        if selection:
+            s = selection[-1]
 
-            else:
-                hover_rects2 = []
-
-        else:
-            hover_rects1 = []
-            hover_rects2 = []
+        hover_rects1 = [s.rect] if s else []
+        hover_rects2 = []
+        for sprite in selection:
+            hover_rects2.extend(corner_rects(sprite.rect))
         # Handle events.
         for event in pygame.event.get():
            
             if event.type == pygame.QUIT:
                 quit_game(game_state)
 
+            elif event.type == JOB_DONE:
+                finish_job(event)
+
+            elif event.type == WORK_DONE:
+                finish_work(event)
+
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
 
@@ -418,20 +493,39 @@ def splicer_loop(game_state):
                         s = top_draggable_sprite_at_point(splice_sprites, get_relative_mouse_pos((splice_canvas.x, splice_canvas.y)))
                         if s:
                             if game_state.get('delete_mode') == True:
-                                splice_sprites.remove(s)
+                                splice_history.remove(s)
 
                             elif game_state.get('copy_mode') == True:
                                 copied_image = s.clone(offset=(20, 20))
 
-                                splice_sprites.add(copied_image)
+                                splice_history.add(copied_image)
 
                                 #s.update_sprite()
 
+                            elif shift_held():
+                                if s in selection:
+                                    selection.remove(s)
+                                else:
+                                    selection.append(s)
+
+                            elif s in selection and len(selection) > 1:
+                                # Drag the whole selection together.
+                                dragging = True
+                                dragged_sprite = s
+                                dragged_sprites = list(selection)
+                                splice_history.start_group_drag(dragged_sprites)
+
                             else:
+                                if s not in selection:
+                                    selection = []
                                 dragging = True
                                 dragged_sprite = s
-                                splice_sprites.remove(s)
-                                splice_sprites.add(s)
+                                dragged_sprites = [s]
+                                splice_history.start_drag(s)
+
+                        elif splice_canvas.collidepoint(pygame.mouse.get_pos()):
+                            band_start = get_relative_mouse_pos((splice_canvas.x, splice_canvas.y))
+
                         if active_input.rect.collidepoint(pygame.mouse.get_pos()) == True:
                             active_input.toggle_active()
                 
@@ -439,46 +533,88 @@ def splicer_loop(game_state):
                     if b:
                         game_state.update({'new_sprite_name': active_input.text}) # TODO: this is a little hacky.
                         game_state = b.on_click(game_state)
-                    if event.button == 3: #right click to select lock a sprite you are hovering on
-                        if s:
-                            if s.selected == False:
-                                s.toggle_selected()
-                                selected = s
-                            elif s.selected == True:
-                                s.toggle_selected()
-                                selected = None
+
+                elif event.button == 3: #right click to select lock a sprite you are hovering on
+                    s = top_draggable_sprite_at_point(splice_sprites, get_relative_mouse_pos((splice_canvas.x, splice_canvas.y)))
+                    if s:
+                        if s in selection:
+                            selection.remove(s)
+                        else:
+                            selection.append(s)
 
             elif event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1:
+                    splice_history.end_drag()
                     dragging = False
                     dragged_sprite = None
+                    dragged_sprites = []
+
+                    if band_rect:
+                        banded = [sprite for sprite in splice_sprites if band_rect.colliderect(sprite.rect)]
+                        if shift_held():
+                            selection += [sprite for sprite in banded if sprite not in selection]
+                        else:
+                            selection = banded
+                    band_start = None
+                    band_rect = None
+
+            elif event.type == pygame.KEYUP:
+                # Releasing a key ends a run of held key transforms.
+                splice_history.seal()
 
             elif event.type == pygame.MOUSEMOTION:
                 if dragging:
-                    dragged_sprite.move(event.rel)
+                    for sprite in dragged_sprites:
+                        sprite.move(event.rel)
+                elif band_start:
+                    x, y = get_relative_mouse_pos((splice_canvas.x, splice_canvas.y))
+                    band_rect = pygame.Rect(min(x, band_start[0]), min(y, band_start[1]), abs(x - band_start[0]), abs(y - band_start[1]))
                 
             
             if active_input.active == True:      
                 active_input.event_handle(event) #Input Box Class has inbuilt event handling function for key down events.
             elif active_input.active == False:
                 if event.type == pygame.KEYDOWN:
-                    if s:
+                    ctrl = event.mod & pygame.KMOD_CTRL
+                    shift = event.mod & pygame.KMOD_SHIFT
+                    if ctrl and event.key == pygame.K_z and not shift:
+                        splice_history.undo()
+                    elif ctrl and (event.key == pygame.K_y or event.key == pygame.K_z):
+                        splice_history.redo()
+                    elif len(selection) > 1:
+                        # Rotate the selection about its centre.
                         if event.key == pygame.K_LEFT:
-                            s.rotate_counterclockwise()
+                            splice_history.transform_group(selection, angle=30)
                         if event.key == pygame.K_RIGHT:
-                            s.rotate_clockwise()
+                            splice_history.transform_group(selection, angle=-30)
                         if event.key == pygame.K_DELETE:
-                            splice_sprites.remove(s)
+                            splice_history.remove_group(selection)
+                            for sprite in selection:
+                                sprite.selected = False
+                            selection = []
+                    elif s:
+                        if event.key == pygame.K_LEFT:
+                            splice_history.transform(s, s.rotate_counterclockwise)
+                        if event.key == pygame.K_RIGHT:
+                            splice_history.transform(s, s.rotate_clockwise)
+                        if event.key == pygame.K_DELETE and s in splice_sprites:
+                            splice_history.remove(s)
 
 
         keys = pygame.key.get_pressed()
-        if s:
+        if len(selection) > 1:
+            if keys[pygame.K_UP]:
+                splice_history.transform_group(selection, factor=GROUP_SCALE_STEP)
+            if keys[pygame.K_DOWN]:
+                splice_history.transform_group(selection, factor=1/GROUP_SCALE_STEP)
+        elif s:
             if keys[pygame.K_UP]:
-                s.scale_up()
+                splice_history.transform(s, s.scale_up)
             if keys[pygame.K_DOWN]:
-                s.scale_down()
+                splice_history.transform(s, s.scale_down)
 
         # Update.
+        splice_sprites.update()
         toast_stack.update()
 
         # Display.
@@ -493,11 +629,14 @@ def splicer_loop(game_state):
 
         control_sprites.draw(game_surface)
         
-        # Only draw the splice sprites inside the splice canvas
-        splice_canvas_surface.fill(white)
-        splice_sprites.draw(splice_canvas_surface)
+        # Only draw the splice sprites inside the splice canvas. The
+        # sprite being dragged or transformed is drawn on its own between
+        # cached layers of everything else.
+        splice_sprites.draw_flattened(splice_canvas_surface, dragged_sprite or s, white)
         draw_rects(hover_rects1, splice_canvas_surface, black, 2)
         draw_rects(hover_rects2, splice_canvas_surface, red, 0)
+        if band_rect:
+            draw_rects([band_rect], splice_canvas_surface, black, 1)
         game_surface.blit(splice_canvas_surface, (splice_canvas.x, splice_canvas.y))
 
         active_input.draw_input_box(game_state)
@@ -505,7 +644,7 @@ def splicer_loop(game_state):
         #confirm_splice.draw_confirm_box(game_state)
 
         if game_state.get('tutorial') == True:
-            open_help(game_state, help_sprites)
+            open_help(game_state)
 
         
             
@@ -514,6 +653,17 @@ def splicer_loop(game_state):
 
         pygame.display.update()
 
-        clock.tick(fps)
+        # Held keys transform every frame, and quick previews are still
+        # waiting to be swapped for smooth images.
+        transforming = keys[pygame.K_UP] or keys[pygame.K_DOWN]
+        unsmoothed = any(not sprite.smooth for sprite in splice_sprites)
+        clock.tick(fps, busy=transforming or unsmoothed or len(toast_stack))
+
+    # Nothing can bring this visit's crops back now, so let them go.
+    splice_sprites.empty()
+    game_state.update({'splice_history': None})
+    for crop_name in crop_names:
+        remove_image(crop_name)
+    del crop_names[:]
 
     return game_state
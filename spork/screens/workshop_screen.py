@@ -3,15 +3,12 @@ import pygame, os
 # Import helper functions.
 from helpers import top_draggable_sprite_at_point, aspect_scale, draw_rects
 from screen_helpers import quit_game, switch_to_screen, notify
+from jobs import JOB_DONE, WORK_DONE, finish_job, finish_work
+from component_packs import component_files, component_name
 
 # Import sprites.
 from sprites.base_sprites import ImageSprite, ButtonSprite, button_at_point, ThumbnailSprite, TextSprite, ButtonImageSprite
 
-pygame.mixer.pre_init(22050, -16, 2, 1024)
-pygame.init()
-pygame.mixer.quit() # Hack to stop sound lagging.
-pygame.mixer.init(22050, -16, 2, 1024)
-
 def add_to_workbench(game_state, item_file):
     #Adds items to the workbench, ready to be passed to the splicer through game state, 
     #also adds button to delete choice
@@ -22,14 +19,14 @@ def add_to_workbench(game_state, item_file):
 
     if not game_state.get('active_sprite1'):
         game_state.update({'active_sprite1': item_file})
-        left = ThumbnailSprite(screen_width*0.275, screen_height*0.55, item_file, screen_width*0.2, screen_width*0.2)
+        left = ThumbnailSprite(screen_width*0.275, screen_height*0.55, item_file, screen_width*0.2, screen_width*0.2, background=True)
         left.rect.centerx = screen_width*0.275 + (left.w / 2)
         left_sprite.add(left)
         general_sprites.add(left_remove_button)
 
     elif not game_state.get('active_sprite2'):
         game_state.update({'active_sprite2': item_file})
-        right = ThumbnailSprite(screen_width*0.5, screen_height*0.55, item_file, screen_width*0.2, screen_width*0.2)
+        right = ThumbnailSprite(screen_width*0.5, screen_height*0.55, item_file, screen_width*0.2, screen_width*0.2, background=True)
         right.rect.centerx = screen_width*0.5 + (right.w / 2)
         right_sprite.add(right)
         general_sprites.add(right_remove_button)
@@ -61,11 +58,14 @@ def start_splicer(game_state):
     game_state = notify(game_state, 'warn', 'You must have two items to splice')
     return game_state
 
+# Height of one row of the item list.
+ROW_HEIGHT = 125
+
 def scroll_up(game_state, surface):
     #scrolls the item list up by moving scrollable_surface and sprites
-    for sprite in scrollable_sprites:
-        if sprite.y > 3800:
-            return game_state
+    # stops a row past the top of the list, whatever its length
+    if scrollable_sprites.sprites()[0].y > ROW_HEIGHT + 10:
+        return game_state
 
     for sprite in scrollable_sprites:
             sprite.y += 10
@@ -76,9 +76,9 @@ def scroll_up(game_state, surface):
     return game_state
 
 def scroll_down(game_state, surface):
-    for sprite in scrollable_sprites:
-        if sprite.y < -3200:
-            return game_state
+    # stops once the last row is in view
+    if scrollable_sprites.sprites()[-2].y < surface.get_height() - ROW_HEIGHT + 10:
+        return game_state
 
     for sprite in scrollable_sprites:
             sprite.y -= 10
@@ -156,7 +156,7 @@ def workshop_loop(game_state):
     )
     splice_button.add(ButtonSprite(screen_width * 0.4, screen_height * 0.5, 'Splice!', start_splicer, [], color=(0,255,0), text_color=(0,0,0)))
 
-    items = os.listdir(os.getcwd() + '/data/pixel-components')
+    items = component_files()
    
     x = 10
     y = 10
@@ -164,14 +164,19 @@ def workshop_loop(game_state):
     general_sprites.add(ButtonSprite(50, 50-20, 'Up', scroll_up, [scroll_surface], w = screen_width*0.2))
     general_sprites.add(ButtonSprite(50, screen_height*0.8 + 50, 'Down', scroll_down, [scroll_surface], screen_width*0.2))
 
-    for item in sorted(items):
-        item_file = os.getcwd() + '/data/pixel-components/' + item
-        temp_item = ButtonImageSprite(x, y, item_file, add_to_workbench, [item_file], w=100, h=100)
+    # Item images are only loaded once they're scrolled near, so packs
+    # of hundreds of components cost nothing until they're looked at.
+    for item_file in items:
+        temp_item = ButtonImageSprite(x, y, item_file, add_to_workbench, [item_file], w=100, h=100, background=True, lazy=True)
         temp_item.rect.centerx = x + (temp_item.w / 2)
         scrollable_sprites.add(temp_item)
-        item_text = item[6:-4]
+        item_text = component_name(item_file)
         scrollable_sprites.add(ButtonSprite(x + 110, y + 40, item_text, add_to_workbench, [item_file], w = 100))
-        y += 125
+        y += ROW_HEIGHT
+
+    row_backgrounds = [pygame.Surface((screen_width*0.2, ROW_HEIGHT)), pygame.Surface((screen_width*0.2, ROW_HEIGHT))]
+    row_backgrounds[0].fill((50,50,50))
+    row_backgrounds[1].fill((150,150,150))
 
     frame_x = screen_width-356
     frame_y = screen_height-155
@@ -198,6 +203,12 @@ def workshop_loop(game_state):
             if event.type == pygame.QUIT:
                 quit_game(game_state)
 
+            elif event.type == JOB_DONE:
+                finish_job(event)
+
+            elif event.type == WORK_DONE:
+                finish_work(event)
+
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if scroll_rect.collidepoint(event.pos) and event.button == 4:
                     scroll_up(game_state, scroll_surface)
@@ -242,14 +253,18 @@ def workshop_loop(game_state):
             splice_button.draw(game_surface)
         
         # draw scrollable items (hacky, obvs)
+        # only what's in view is drawn, and item images start loading a
+        # row before they scroll into it
         offset = scrollable_sprites.sprites()[0].rect.y - 10
+        visible = scroll_surface.get_rect()
+        nearby = visible.inflate(0, 2 * ROW_HEIGHT)
         for i, s in enumerate(scrollable_sprites.sprites()):
-            bg = pygame.Surface((screen_width*0.2, 125))
-            if i % 2:
-                bg.fill((150,150,150))
-            else:
-                bg.fill((50,50,50))
-            scroll_surface.blit(bg, (0, (i * 125) + offset))
+            if visible.colliderect(pygame.Rect(0, (i * ROW_HEIGHT) + offset, visible.w, ROW_HEIGHT)):
+                scroll_surface.blit(row_backgrounds[i % 2], (0, (i * ROW_HEIGHT) + offset))
+            if not nearby.colliderect(s.rect):
+                continue
+            if type(s) is ButtonImageSprite:
+                s.fit_image()
             scroll_surface.blit(s.image, s.rect)
 
         left_sprite.draw(game_surface)
@@ -263,6 +278,6 @@ def workshop_loop(game_state):
 
         pygame.display.update()
 
-        clock.tick(fps)
+        clock.tick(fps, busy=len(toast_stack))
 
     return game_state
@@ -0,0 +1,91 @@
+import pygame, os, sys, hashlib
+
+from image_cache import file_version
+from telemetry import timed
+
+"""This module loads sound effects already converted to the mixer's own
+format, so playing one never waits on decoding or resampling.
+
+The effects under data/sounds come as WAV, OGG and FLAC at all sorts of
+rates. The first time each is loaded it is decoded by the mixer, and the
+resulting PCM is written to data/temp/sounds. From then on loading is a
+plain copy of that buffer into a Sound. Run this module directly to
+convert every effect up front.
+"""
+
+SOUNDS_DIR = os.getcwd() + '/data/sounds'
+PCM_DIR = os.getcwd() + '/data/temp/sounds'
+
+# Music is streamed by the music module, not converted here.
+SKIP_DIRS = ('music',)
+
+# Loaded sounds keyed by path, each stored with the version of the file
+# it was loaded from. Every caller shares the one Sound.
+sounds = {}
+
+
+def pcm_path(path, version):
+    """Where the converted PCM for this version of the file at 'path' is
+    kept, for the format the mixer is currently running at.
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    key = '{0}|{1}|{2}|{3}|{4}|{5}'.format(os.path.abspath(path), version[0], version[1], frequency, size, channels)
+    return PCM_DIR + '/' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pcm'
+
+def convert_sound(path, version):
+    """Decodes the file at 'path' into the mixer's format and saves the
+    PCM. Returns the PCM bytes.
+    """
+    raw = pygame.mixer.Sound(path).get_raw()
+    if not os.path.isdir(PCM_DIR):
+        os.makedirs(PCM_DIR)
+
+    # Write then rename so a half written file is never picked up.
+    target = pcm_path(path, version)
+    with open(target + '.part', 'wb') as f:
+        f.write(raw)
+    os.replace(target + '.part', target)
+    return raw
+
+def load_sound(path):
+    """Returns the Sound for the file at 'path', converting it the first
+    time. The returned Sound is shared, don't change its volume.
+    """
+    version = file_version(path)
+    entry = sounds.get(path)
+    if entry is None or entry[0] != version:
+        with timed('load sound', path):
+            cached = pcm_path(path, version)
+            if os.path.exists(cached):
+                with open(cached, 'rb') as f:
+                    raw = f.read()
+            else:
+                raw = convert_sound(path, version)
+
+            entry = (version, pygame.mixer.Sound(buffer=raw))
+        sounds[path] = entry
+
+    return entry[1]
+
+def convert_all():
+    """Converts every sound effect that isn't already. Returns how many
+    were converted.
+    """
+    converted = 0
+    for root, dirs, files in os.walk(SOUNDS_DIR):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            version = file_version(path)
+            if not os.path.exists(pcm_path(path, version)):
+                convert_sound(path, version)
+                converted += 1
+    return converted
+
+
+if __name__ == "__main__":
+    pygame.mixer.pre_init(22050, -16, 2, 1024)
+    pygame.mixer.init()
+    print('Converted {0} sounds.'.format(convert_all()))
+    pygame.quit()
+    sys.exit(0)
@@ -0,0 +1,238 @@
+import pygame
+
+from sprites.base_sprites import update_sprites, MIN_SCALE
+
+"""This module keeps the undo/redo history of the splicer.
+
+The history is a log of small command tuples describing what changed on
+each sprite (its position, rotation, scale, z-order or whether it is on
+the canvas), never copies of images. Undoing a step just puts those
+numbers back, so it costs the same however big the images are.
+"""
+
+# Oldest steps are forgotten beyond this many.
+MAX_HISTORY = 1000
+
+
+def insert_sprite(group, sprite, index):
+    """Puts 'sprite' back into the ordered 'group' at 'index'.
+    """
+    sprites = group.sprites()
+    if sprite in sprites:
+        sprites.remove(sprite)
+    sprites.insert(index, sprite)
+    group.empty()
+    group.add(*sprites)
+
+def set_transform(sprite, rotation, scale):
+    sprite.rotation = rotation
+    sprite.scale = scale
+    sprite.update_sprite()
+
+def sprite_state(sprite):
+    return (sprite.rotation, sprite.scale, sprite.rect.center)
+
+def set_states(sprites, states):
+    """Puts each sprite into its (rotation, scale, center) state in one
+    batched pass.
+    """
+    for sprite, state in zip(sprites, states):
+        sprite.rotation, sprite.scale = state[0], state[1]
+    update_sprites(sprites)
+    for sprite, state in zip(sprites, states):
+        sprite.rect.center = state[2]
+        sprite.changed()
+
+
+class SpliceHistory(object):
+    """Applies changes to the splice sprites and logs them so they can
+    be undone and redone.
+
+    Commands are tuples of:
+        ('add', sprite, index)
+        ('remove', sprite, index)
+        ('remove_group', sprites, indexes)
+        ('transform', sprite, old_rotation, old_scale, new_rotation, new_scale)
+        ('drag', sprite, old_index, new_index, dx, dy)
+        ('group', sprites, old_states, new_states)
+
+    where a group state is a (rotation, scale, center) tuple per sprite.
+    """
+
+    def __init__(self, sprites):
+        self.sprites = sprites
+        self.undo_log = []
+        self.redo_log = []
+
+        # While set, transforms of the same sprite join the last entry.
+        self.coalescing = False
+
+        self.drag = None
+
+    def record(self, command):
+        self.undo_log.append(command)
+        if len(self.undo_log) > MAX_HISTORY:
+            del self.undo_log[0]
+        self.redo_log = []
+
+    def seal(self):
+        """Stops the next transform joining the previous history entry.
+        Called whenever a key or mouse button is released.
+        """
+        self.coalescing = False
+
+    def add(self, sprite):
+        self.sprites.add(sprite)
+        self.record(('add', sprite, len(self.sprites) - 1))
+        self.seal()
+
+    def remove(self, sprite):
+        index = self.sprites.sprites().index(sprite)
+        self.sprites.remove(sprite)
+        self.record(('remove', sprite, index))
+        self.seal()
+
+    def remove_group(self, sprites):
+        """Removes 'sprites' from the canvas as one history entry.
+        """
+        order = self.sprites.sprites()
+        removed = sorted((order.index(sprite), sprite) for sprite in set(sprites) if sprite in order)
+        if not removed:
+            return
+        sprites = tuple(sprite for index, sprite in removed)
+        self.sprites.remove(*sprites)
+        self.record(('remove_group', sprites, [index for index, sprite in removed]))
+        self.seal()
+
+    def transform(self, sprite, f):
+        """Calls f() to rotate or scale 'sprite' and logs the change.
+        Held key steps on one sprite are coalesced into a single entry.
+        """
+        old_rotation, old_scale = sprite.rotation, sprite.scale
+        f()
+        if (sprite.rotation, sprite.scale) == (old_rotation, old_scale):
+            return
+
+        last = self.undo_log[-1] if self.undo_log else None
+        if self.coalescing and last and last[0] == 'transform' and last[1] is sprite:
+            old_rotation, old_scale = last[2], last[3]
+            self.undo_log.pop()
+
+        self.record(('transform', sprite, old_rotation, old_scale, sprite.rotation, sprite.scale))
+        self.coalescing = True
+
+    def transform_group(self, sprites, angle=0, factor=1.0):
+        """Rotates 'sprites' by 'angle' degrees about their centroid and
+        scales them, and the space between them, by 'factor'. The group
+        stops shrinking once any of them is down to MIN_SCALE.
+        """
+        sprites = tuple(sprites)
+        old_states = [sprite_state(sprite) for sprite in sprites]
+        factor = max([factor] + [min(MIN_SCALE / state[1], 1.0) for state in old_states])
+        if angle % 360 == 0 and factor == 1.0:
+            return
+        centre_x = sum(state[2][0] for state in old_states) / float(len(sprites))
+        centre_y = sum(state[2][1] for state in old_states) / float(len(sprites))
+
+        new_states = []
+        for rotation, scale, center in old_states:
+            # Screen y points down, so turn the offset the other way to
+            # match pygame's counterclockwise image rotation.
+            offset = pygame.math.Vector2(center[0] - centre_x, center[1] - centre_y)
+            offset = offset.rotate(-angle) * factor
+            new_center = (int(round(centre_x + offset.x)), int(round(centre_y + offset.y)))
+            new_states.append(((rotation + angle) % 360, scale * factor, new_center))
+        set_states(sprites, new_states)
+
+        last = self.undo_log[-1] if self.undo_log else None
+        if self.coalescing and last and last[0] == 'group' and last[1] == sprites:
+            old_states = last[2]
+            self.undo_log.pop()
+
+        self.record(('group', sprites, old_states, new_states))
+        self.coalescing = True
+
+    def start_group_drag(self, sprites):
+        """Remembers where a group of sprites started before they are
+        dragged together. Their order is left alone.
+        """
+        sprites = tuple(sprites)
+        self.drag = ('group', sprites, [sprite_state(sprite) for sprite in sprites])
+
+    def start_drag(self, sprite):
+        """Brings 'sprite' to the top and remembers where it started.
+        """
+        old_index = self.sprites.sprites().index(sprite)
+        self.sprites.remove(sprite)
+        self.sprites.add(sprite)
+        self.drag = ('drag', sprite, old_index, sprite.rect.x, sprite.rect.y)
+
+    def end_drag(self):
+        if not self.drag:
+            return
+
+        if self.drag[0] == 'group':
+            kind, sprites, old_states = self.drag
+            self.drag = None
+            new_states = [sprite_state(sprite) for sprite in sprites]
+            if new_states != old_states:
+                self.record(('group', sprites, old_states, new_states))
+            self.seal()
+            return
+
+        kind, sprite, old_index, x, y = self.drag
+        self.drag = None
+
+        new_index = self.sprites.sprites().index(sprite)
+        dx, dy = sprite.rect.x - x, sprite.rect.y - y
+        if dx or dy or old_index != new_index:
+            self.record(('drag', sprite, old_index, new_index, dx, dy))
+        self.seal()
+
+    def undo(self):
+        if not self.undo_log:
+            return False
+        self.seal()
+        command = self.undo_log.pop()
+        self.redo_log.append(command)
+
+        kind, sprite = command[0], command[1]
+        if kind == 'add':
+            self.sprites.remove(sprite)
+        elif kind == 'remove':
+            insert_sprite(self.sprites, sprite, command[2])
+        elif kind == 'remove_group':
+            # Lowest first, so each goes back to exactly where it was.
+            for sprite, index in zip(command[1], command[2]):
+                insert_sprite(self.sprites, sprite, index)
+        elif kind == 'transform':
+            set_transform(sprite, command[2], command[3])
+        elif kind == 'drag':
+            sprite.move((-command[4], -command[5]))
+            insert_sprite(self.sprites, sprite, command[2])
+        elif kind == 'group':
+            set_states(command[1], command[2])
+        return True
+
+    def redo(self):
+        if not self.redo_log:
+            return False
+        self.seal()
+        command = self.redo_log.pop()
+        self.undo_log.append(command)
+
+        kind, sprite = command[0], command[1]
+        if kind == 'add':
+            insert_sprite(self.sprites, sprite, command[2])
+        elif kind == 'remove':
+            self.sprites.remove(sprite)
+        elif kind == 'remove_group':
+            self.sprites.remove(*command[1])
+        elif kind == 'transform':
+            set_transform(sprite, command[4], command[5])
+        elif kind == 'drag':
+            sprite.move((command[4], command[5]))
+            insert_sprite(self.sprites, sprite, command[3])
+        elif kind == 'group':
+            set_states(command[1], command[3])
+        return True
@@ -1,20 +1,63 @@
-import pygame, os
-
-# Importing screens
-from screens.main_menu_screen import main_menu_loop
-from screens.result_screen import result_loop
-from screens.splicer_screen import splicer_loop
-from screens.workshop_screen import workshop_loop
-from screens.game_end_screen import game_end_loop
+# Start the startup clock before anything slow is imported.
+import startup
+
+import pygame, os, sys, argparse, importlib
+
+parser = argparse.ArgumentParser(description='Spork, a game about invention and cutlery.')
+parser.add_argument('--record', metavar='FILE', help='record this session to FILE')
+parser.add_argument('--replay', metavar='FILE', help='replay the session in FILE headlessly at full speed')
+parser.add_argument('--telemetry', metavar='DIR', help='record performance telemetry to DIR')
+parser.add_argument('--startup-report', action='store_true', help='print how long startup took once the first frame is up')
+parser.add_argument('--export', metavar='SCALE', type=int, help='also export every invention at SCALE times the size, for printing')
+args = parser.parse_args()
+startup.report_enabled = args.startup_report
+startup.mark('import pygame')
+
+if args.replay:
+    # Replays need no window or speakers. SDL has to be told before
+    # pygame is initialised below.
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
 
 from sprites.base_sprites import ToastStack
+from recorder import SessionRecorder, SessionReplayer, ReplayFinished
+from music import MusicPlayer
+from sound_cache import load_sound
+from adaptive_clock import AdaptiveClock
+from async_runner import run, run_screen
+import telemetry
+
+# Screen modules are only imported the first time they're shown, so the
+# main menu doesn't wait for the others.
+screens = {
+    'main_menu_screen': ('screens.main_menu_screen', 'main_menu_loop'),
+    'workshop_screen': ('screens.workshop_screen', 'workshop_loop'),
+    'splicer_screen': ('screens.splicer_screen', 'splicer_loop'),
+    'result_screen': ('screens.result_screen', 'result_loop'),
+    'game_end_screen': ('screens.game_end_screen', 'game_end_loop'),
+    'gallery_screen': ('screens.gallery_screen', 'gallery_loop'),
+}
+screen_loops = {}
+
+def screen_loop(name):
+    if name not in screen_loops:
+        module_name, loop_name = screens[name]
+        screen_loops[name] = getattr(importlib.import_module(module_name), loop_name)
+    return screen_loops[name]
+
+startup.mark('import game modules')
 
-# Initialise pygame stuff.
+if args.telemetry:
+    telemetry.start(args.telemetry)
+
+# Initialise pygame stuff. The mixer settings have to be given before
+# pygame.init(), a small buffer keeps sounds from lagging.
 pygame.mixer.pre_init(22050, -16, 2, 1024)
 pygame.init()
-pygame.mixer.quit() # Hack to stop sound lagging.
-pygame.mixer.init(22050, -16, 2, 1024)
-clock = pygame.time.Clock()
+startup.mark('pygame.init')
+clock = AdaptiveClock(pygame.time.Clock())
+music = MusicPlayer()
+clock.frame_hooks.append(music.update)
 built_sprites = pygame.sprite.OrderedUpdates()
 display_width = 1200
 display_height = 675
@@ -23,12 +66,14 @@ pygame.display.set_caption('Spork')
 icon = pygame.image.load(os.getcwd() + '/data/imgbase/sporktop.png')
 pygame.display.set_icon(icon)
 pygame.display.update()
+startup.mark('open window')
 
 game_state = {
     'clock': clock,
     'fps': 60,
     'game_surface': game_surface,
-    'click_sound': pygame.mixer.Sound(os.getcwd() + '/data/sounds/click.wav'),
+    'click_sound': load_sound(os.getcwd() + '/data/sounds/click.wav'),
+    'music': music,
     'active_screen': 'main_menu_screen',
     'screen_done': False,
     'company_name': '',
@@ -44,48 +89,62 @@ game_state = {
     'delete_mode': False,
     'copy_mode': False,
     'tutorial': False,
+    'export_scale': args.export,
 }
 
-done = False
-
-while not done:
-    active_screen = game_state.get('active_screen')
-
-    toast_stack = ToastStack()
-    toast_stack.init_size(game_state.get('screen_size'))
-    game_state.update({'toast_stack': toast_stack})
-
-    if game_state.get('music_done'):
-        game_state.update({'music_done': False})
-        pygame.mixer.music.fadeout(500)
-        music = '/data/sounds/music/' + game_state.get('active_music')
-        pygame.mixer.music.load(os.getcwd() + music)
-        pygame.mixer.music.play(loops=-1)
-
-    if game_state.get('quit'):
-        done = True
-
-    elif active_screen == 'main_menu_screen':
-        game_state.update({'screen_done': False})
-        game_state = main_menu_loop(game_state)
-
-    elif active_screen == 'workshop_screen':
-        game_state.update({'screen_done': False})
-        game_state = workshop_loop(game_state)
-
-    elif active_screen == 'splicer_screen':
-        game_state.update({'screen_done': False})
-        game_state = splicer_loop(game_state)
-
-    elif active_screen == 'packaging_screen':
-        pass                # TODO
-
-    elif active_screen == 'result_screen':
-        game_state.update({'screen_done': False})
-        game_state = result_loop(game_state)
-
-    elif active_screen == 'game_end_screen':
-        game_state.update({'screen_done': False})
-        game_state = game_end_loop(game_state)
-
+toast_stack = ToastStack()
+toast_stack.init_size(game_state.get('screen_size'))
+game_state.update({'toast_stack': toast_stack})
+
+session = None
+if args.replay:
+    session = SessionReplayer(args.replay)
+elif args.record:
+    session = SessionRecorder(args.record)
+if session:
+    game_state = session.install(game_state)
+
+async def main(game_state):
+    """Shows screens one after another until the game is quit.
+    """
+    done = False
+    while not done:
+        active_screen = game_state.get('active_screen')
+
+        game_state.get('toast_stack').clear()
+
+        if game_state.get('music_done'):
+            game_state.update({'music_done': False})
+            game_state.get('music').play(game_state.get('active_music'))
+
+        if game_state.get('quit'):
+            done = True
+
+        elif active_screen == 'packaging_screen':
+            pass                # TODO
+
+        elif active_screen in screens:
+            game_state.update({'screen_done': False})
+            telemetry.screen_shown(active_screen)
+            game_state = await run_screen(screen_loop(active_screen), game_state)
+
+    return game_state
+
+matched = True
+try:
+    try:
+        game_state = run(main(game_state))
+    except ReplayFinished:
+        pass
+
+    if session:
+        matched = session.finish(game_state)
+finally:
+    # Keep whatever was recorded even if the game crashed.
+    if session:
+        session.close()
+
+game_state.get('music').close()
+telemetry.stop()
 pygame.quit()
+sys.exit(0 if matched else 1)
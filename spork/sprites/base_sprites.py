@@ -1,8 +1,54 @@
 import pygame, os
 import math
+from collections import OrderedDict
 
 # Import helper functions.
 from helpers import top_draggable_sprite_at_point, aspect_scale, draw_rects
+from image_cache import cached_transform, cached_smooth_transform, load_image, pyramid_level
+from adaptive_clock import blink_on
+from jobs import JOB_DONE, WORK_DONE, submit, finish_job, finish_work
+
+# How many frames a transformed sprite must be left alone before its
+# quick preview is swapped for a smooth version. Counted in frames, not
+# time, so a replay smooths sprites on exactly the same frames.
+SMOOTH_DELAY_FRAMES = 15
+
+# Smallest scale, in percent, a sprite can be shrunk to. Below this its
+# image is too small to see or click.
+MIN_SCALE = 2
+
+# Background and text colour of toasts for each message level.
+TOAST_COLORS = {
+    'error': ((244, 66, 66), (0, 0, 0)),
+    'warn': ((244, 190, 65), (0, 0, 0)),
+    'ok': ((65, 244, 110), (0, 0, 0)),
+}
+
+# Most rendered toasts kept before the least recently used go.
+MAX_TOAST_IMAGES = 32
+
+# The default font at each size, shared by every sprite that uses it.
+fonts = {}
+
+def default_font(size):
+    if size not in fonts:
+        fonts[size] = pygame.font.SysFont(None, size)
+    return fonts[size]
+
+# Empty boxes shown by lazy image buttons until they're fitted, one for
+# each size. Nothing draws on them.
+empty_boxes = {}
+
+def empty_box(size):
+    if size not in empty_boxes:
+        empty_boxes[size] = pygame.Surface(size, pygame.SRCALPHA, 32)
+    return empty_boxes[size]
+
+def fitted_image(path, size):
+    """Loads the image at 'path', trimmed and scaled to fit 'size'.
+    """
+    image, offset = load_image(path, trim=True)
+    return aspect_scale(image, size)
 
 def button_at_point(sprites, pos):
     """Returns a sprite from the sprite group containing the mouse
@@ -44,33 +90,50 @@ class BaseSprite(pygame.sprite.Sprite):
         """
         raise NotImplementedError('Please implement an init_image method')
 
+    def fit_image_later(self, path, size):
+        """Shows an empty 'size' box until the image at 'path', fitted
+        into it on a worker thread, is ready. The image lands centred
+        under the top of the box.
+        """
+        self.image = pygame.Surface((int(size[0]), int(size[1])), pygame.SRCALPHA, 32)
+        submit(fitted_image, path, size, on_done=self.land_image)
+
+    def land_image(self, image):
+        midtop = self.rect.midtop
+        self.image = image
+        self.rect.size = image.get_size()
+        self.rect.midtop = midtop
+
 
 class ImageSprite(BaseSprite):
     """Sprite which loads an image.
 
-    Currently this will load the image each time a sprite is made,
-    should cache images somewhere in future.
+    Images are loaded through image_cache with their transparent border
+    trimmed off. The sprite is offset by the trimmed amount so it sits
+    exactly where the untrimmed image would have.
     """
 
     def __init__(self, x, y, img_name):
         # Need the image name before init_image is called
         self.img_name = img_name
 
+        # The uncropped image this sprite came from and which of the
+        # two spliced components it is, if any.
+        self.source = img_name
+        self.component = None
+
         # Call the parent constructor.
         super(ImageSprite, self).__init__(x, y)
+        self.rect.x += self.trim_offset[0]
+        self.rect.y += self.trim_offset[1]
 
         # These image sprites should be draggable.
         self.is_draggable = True
 
     def init_image(self):
-        # Load the image from file and get its size.
-        loaded_img = pygame.image.load(self.img_name)
-        size = loaded_img.get_size()
-
-        # Create a surface containing the image with a transparent
-        # background.
-        self.image = pygame.Surface(size, pygame.SRCALPHA, 32)
-        self.image.blit(loaded_img, (0, 0))
+        # Load the trimmed image and get its size.
+        self.image, self.trim_offset = load_image(self.img_name, trim=True)
+        size = self.image.get_size()
         self.origimage = self.image
         self.rotation = 0
         # self.center_point = self.rect.center()
@@ -80,15 +143,24 @@ class ImageSprite(BaseSprite):
         self.scale = 100
         self.selected = False # allows object to be selected even when not hovered over
 
+        # The untransformed image needs no smoothing.
+        self.smooth = True
+        self.frames_unchanged = 0
+
     def clone(self, offset=(0, 0)):
         x_offset, y_offset = offset
         clone = ImageSprite(self.x + x_offset, self.y + y_offset, self.img_name)
         clone.image = self.image
+        clone.origimage = self.origimage
         clone.rect = self.image.get_rect()
         clone.rect.x = self.rect.x + x_offset
         clone.rect.y = self.rect.y + y_offset
         clone.rotation = self.rotation
         clone.scale = self.scale
+        clone.source = self.source
+        clone.component = self.component
+        clone.smooth = self.smooth
+        clone.frames_unchanged = self.frames_unchanged
         return clone
 
     def move(self, move):
@@ -99,21 +171,27 @@ class ImageSprite(BaseSprite):
         self.y += move[1]
         self.rect.x += move[0]
         self.rect.y += move[1]
+        self.changed()
+
+    def changed(self):
+        """Lets the flattened groups this sprite is in know its image or
+        position has changed. Call it after changing either from outside.
+        """
+        for group in self.groups():
+            if isinstance(group, FlattenedOrderedUpdates):
+                group.sprite_changed(self)
 
     def rotate_clockwise(self):
-        self.rotation = self.rotation - 30
-        if self.rotation == 360:
-            self.rotation = 0
+        # Kept within 0-359, so each angle has one transform cache key.
+        self.rotation = (self.rotation - 30) % 360
         self.update_sprite()
 
     def rotate_counterclockwise(self):
-        self.rotation = self.rotation + 30
-        if self.rotation == 360:
-            self.rotation = 0
+        self.rotation = (self.rotation + 30) % 360
         self.update_sprite()
 
     def scale_down(self):
-        if self.scale - 2 > 0:
+        if self.scale - 2 >= MIN_SCALE:
             self.scale = self.scale - 2
         self.update_sprite()
 
@@ -121,8 +199,33 @@ class ImageSprite(BaseSprite):
         self.scale += 2
         self.update_sprite()
 
-    def update_sprite(self):
+    def transform_key(self):
+        return (self.origimage, self.rotation, self.scale)
+
+    def update_sprite(self, image=None):
+        """Show a quick nearest neighbour preview of the sprite's new
+        state. update() swaps in a smooth version once the sprite has
+        been left alone for a moment.
 
+        'image' can be passed in when it is already known to be the
+        transformed image for this state.
+        """
+        loc = self.rect.center
+
+        # Sprites sharing a source and state share the transformed image.
+        if image is None:
+            image = cached_transform(self.origimage, self.rotation, self.scale, self.transform_image)
+        self.image = image
+        self.rect = self.image.get_rect()
+        self.rect.center = loc
+        self.smooth = False
+        self.frames_unchanged = 0
+        self.changed()
+
+    def transform_image(self):
+        """Rotate and scale the original image to the sprite's current
+        state.
+        """
         rotrads = (self.rotation*2*math.pi)/360
         scaled_width = (self.orig_width*self.scale)/100
         scaled_height = (self.orig_height*self.scale)/100
@@ -131,12 +234,48 @@ class ImageSprite(BaseSprite):
 
         new_height = abs(scaled_width*math.sin(rotrads)) + abs(scaled_height*math.cos(rotrads))
 
-        loc = self.rect.center
+        # Rotate the smallest pyramid level that still covers the
+        # scaled size rather than the full size original.
+        source = pyramid_level(self.origimage, (scaled_width, scaled_height))
+        tempimage = pygame.transform.rotate(source, self.rotation)
+        return aspect_scale( tempimage, (new_width, new_height))
 
-        tempimage = pygame.transform.rotate(self.origimage, self.rotation)
-        self.image = aspect_scale( tempimage, (new_width, new_height))
-        self.rect = self.image.get_rect()
-        self.rect.center = loc
+    def smooth_transform_image(self, on_ready, wait=False):
+        """Returns an antialiased version of the current preview image,
+        or None if it is still being made in the background, in which
+        case on_ready is called with it once it's handed over.
+        """
+        scaled_size = ((self.orig_width*self.scale)/100, (self.orig_height*self.scale)/100)
+        source = pyramid_level(self.origimage, scaled_size)
+        rotation = self.rotation
+        size = self.image.get_size()
+
+        def make():
+            rotated = pygame.transform.rotozoom(source, rotation, 1)
+            return pygame.transform.smoothscale(rotated, size)
+
+        return cached_smooth_transform(self.origimage, self.rotation, self.scale, make, on_ready, wait)
+
+    def use_smooth_image(self, wait=False):
+        key = self.transform_key()
+
+        def land(smooth_image):
+            # Only if the sprite hasn't been transformed again meanwhile.
+            if not self.smooth and self.transform_key() == key:
+                self.image = smooth_image
+                self.smooth = True
+                self.changed()
+
+        smooth_image = self.smooth_transform_image(land, wait)
+        if smooth_image:
+            land(smooth_image)
+
+    def update(self):
+        if self.smooth:
+            return
+        self.frames_unchanged += 1
+        if self.frames_unchanged == SMOOTH_DELAY_FRAMES:
+            self.use_smooth_image()
 
     def toggle_selected(self):
         if self.selected == False:
@@ -147,6 +286,21 @@ class ImageSprite(BaseSprite):
             return
 
 
+def update_sprites(sprites):
+    """Calls update_sprite on many image sprites in one pass, looking
+    each distinct state up only once, so transforming many copies of a
+    sprite costs about the same as transforming one.
+    """
+    images = {}
+    for sprite in sprites:
+        key = sprite.transform_key()
+        if key in images:
+            sprite.update_sprite(images[key])
+        else:
+            sprite.update_sprite()
+            images[key] = sprite.image
+
+
 class ButtonSprite(BaseSprite):
     """Sprite which displays as a clickable button with text.
     """
@@ -162,7 +316,7 @@ class ButtonSprite(BaseSprite):
         self.text_color = text_color
 
         # Define button text font.
-        self.font = pygame.font.SysFont(None, 25)
+        self.font = default_font(25)
 
         # Call the parent constructor.
         super(ButtonSprite, self).__init__(x, y)
@@ -185,7 +339,7 @@ class ButtonSprite(BaseSprite):
 class ButtonImageSprite(BaseSprite):
     "clickable image that performs a function"
 
-    def __init__(self,x ,y, img_path, f, args, w=None, h=None):
+    def __init__(self,x ,y, img_path, f, args, w=None, h=None, background=False, lazy=False):
         self.x = x
         self.y = y
         self.img_path = img_path
@@ -193,20 +347,33 @@ class ButtonImageSprite(BaseSprite):
         self.args = args
         self.w = w
         self.h = h
+        self.background = background
+
+        # Shown as an empty box until fit_image is called, for long lists
+        # where most buttons are never scrolled to.
+        self.lazy = lazy
         
         super(ButtonImageSprite, self).__init__(x,y)
 
     def init_image(self):
-        loaded_img = pygame.image.load(self.img_path)
-        size = loaded_img.get_size()
-
-        # Create a surface containing the image with a transparent
-        # background.
+        # Images fitted into a box are trimmed first so any transparent
+        # border doesn't shrink them.
+        if self.w and self.lazy:
+            self.image = empty_box((int(self.w), int(self.h)))
+        elif self.w and self.background:
+            self.fit_image_later(self.img_path, (self.w, self.h))
+        elif self.w:
+            self.image = fitted_image(self.img_path, (self.w, self.h))
+        else:
+            self.image, offset = load_image(self.img_path)
 
-        self.image = pygame.Surface(size, pygame.SRCALPHA, 32)
-        self.image.blit(loaded_img, (0, 0))
-        if self.w:
-            self.image = aspect_scale(self.image, (self.w, self.h))
+    def fit_image(self):
+        """Starts fitting a lazy button's image on a worker thread, if it
+        hasn't been already.
+        """
+        if self.lazy:
+            self.lazy = False
+            self.fit_image_later(self.img_path, (self.w, self.h))
 
 
     def on_click(self, game_state):
@@ -228,7 +395,7 @@ class TextSprite(BaseSprite):
         if arcade_font:
             self.font = pygame.font.Font("ARCADECLASSIC.TTF", 40)
         else:
-            self.font = pygame.font.SysFont(None, 30)
+            self.font = default_font(30)
         self.text_color = text_color
         
         # Call the parent constructor.
@@ -262,54 +429,47 @@ class TextSprite(BaseSprite):
 
 class ToastSprite(BaseSprite):
     """Displays a notification at the bottom of the screen.
+
+    Toast sprites are pooled by their ToastStack and given a new message
+    with show() each time one is needed.
     """
 
-    def __init__(self, screen_size, index, message):
-        self.level = message.get('level')
-        self.text = message.get('text')
+    def __init__(self, screen_size):
         self.screen_size = screen_size
         self.w = screen_size[0] * 0.5
         self.h = screen_size[1] * 0.1
+        self.full_image = pygame.Surface((self.w, self.h))
+
+        super(ToastSprite, self).__init__(self.screen_size[0] * 0.25, 0)
+
+    def init_image(self):
+        self.image = self.full_image
+
+    def show(self, index, level, text, image):
         self.index = index
+        self.level = level
+        self.text = text
+        self.count = 1
         self.age = 0
         self.done = False
         self.to_remove = False
         self.target_h = self.h
+        self.set_full_image(image)
+        self.rect.y = self.h * (9 - self.index)
 
-        if self.level == 'error':
-            self.background_color = (244, 66, 66)
-            self.text_color = (0, 0, 0)
-        elif self.level == 'warn':
-            self.background_color = (244, 190, 65)
-            self.text_color = (0, 0, 0)
-        elif self.level == 'ok':
-            self.background_color = (65, 244, 110)
-            self.text_color = (0, 0, 0)
-
-        super(ToastSprite, self).__init__(
-            self.screen_size[0] * 0.25,
-            self.h * (9 - self.index)
-        )
-        self.target_y = self.rect.y
+    def repeat(self, image):
+        """The same message was sent again, count it and keep it up.
+        """
+        self.count += 1
+        self.age = 0
+        self.set_full_image(image)
 
-    def init_image(self):
-        self.image = pygame.Surface((self.w, self.h))
-        self.image.fill(self.background_color)
-        text = TextSprite(
-            0,
-            0,
-            self.w * 0.8,
-            self.h,
-            self.text,
-            text_color=self.text_color
-        )
-        x_offset = (self.w * 0.5) - (text.max_x * 0.5)
-        y_offset = (self.h * 0.5) - (text.max_y * 0.5)
-        self.image.blit(text.image, (x_offset, y_offset))
+    def set_full_image(self, image):
+        self.full_image = image
+        self.image = image
 
     def slide_down_by_one(self, new_index):
         self.index = new_index
-        self.target_y += self.h
 
     def update(self, i):
         self.rect.x = self.screen_size[0] * 0.25
@@ -318,38 +478,79 @@ class ToastSprite(BaseSprite):
         if not self.done:
             self.age += 1
         elif self.target_h > 0:
+            # Collapse by showing less of the rendered toast each frame.
             self.target_h = max(self.target_h - 6, 0)
-            self.image = pygame.transform.scale(
-                self.image,
-                (int(self.w), int(self.target_h))
-            )
+            self.image = self.full_image.subsurface((0, 0, int(self.w), int(self.target_h)))
         else:
             self.to_remove = True
 
-        if self.target_y > self.y:
-            self.y = max(self.y + 1, self.target_y)
-            self.rect.y = self.y
-
 
 class ToastStack(pygame.sprite.Group):
     """Displays messages the bottom of the screen for a few seconds to
     notify the player of something.
+
+    A message sent again while its toast is still up adds to a count on
+    that toast rather than stacking another. Rendered toasts are cached
+    by message and finished sprites are kept to be reused.
     """
 
     def __init__(self):
         super(ToastStack, self).__init__()
+        self.pool = []
+        self.images = OrderedDict()
 
     def init_size(self, screen_size):
         self.screen_size = screen_size
 
+    def toast_image(self, level, text, count):
+        key = (level, text, count)
+        image = self.images.get(key)
+        if image is not None:
+            self.images.move_to_end(key)
+            return image
+
+        w = self.screen_size[0] * 0.5
+        h = self.screen_size[1] * 0.1
+        background_color, text_color = TOAST_COLORS[level]
+        if count > 1:
+            text = '{0} (x{1})'.format(text, count)
+
+        image = pygame.Surface((w, h))
+        image.fill(background_color)
+        text = TextSprite(0, 0, w * 0.8, h, text, text_color=text_color)
+        x_offset = (w * 0.5) - (text.max_x * 0.5)
+        y_offset = (h * 0.5) - (text.max_y * 0.5)
+        image.blit(text.image, (x_offset, y_offset))
+
+        self.images[key] = image
+        if len(self.images) > MAX_TOAST_IMAGES:
+            self.images.popitem(last=False)
+        return image
+
     def push(self, message):
-        index = len(self.sprites())
-        self.add(ToastSprite(self.screen_size, index, message))
+        level = message.get('level')
+        text = message.get('text')
+
+        for toast in self.sprites():
+            if not toast.done and toast.level == level and toast.text == text:
+                toast.repeat(self.toast_image(level, text, toast.count + 1))
+                return
+
+        toast = self.pool.pop() if self.pool else ToastSprite(self.screen_size)
+        toast.show(len(self.sprites()), level, text, self.toast_image(level, text, 1))
+        self.add(toast)
 
     def pop(self, toast):
         self.remove(toast)
+        self.pool.append(toast)
         self.slide_down()
 
+    def clear(self):
+        """Takes every toast down at once, ready for a new screen.
+        """
+        self.pool.extend(self.sprites())
+        self.empty()
+
     def slide_down(self):
         for i, toast in enumerate(self.sprites()):
             toast.slide_down_by_one(i)
@@ -363,31 +564,112 @@ class ToastStack(pygame.sprite.Group):
                 toast.done = True
 
 
+class FlattenedOrderedUpdates(pygame.sprite.OrderedUpdates):
+    """Ordered group which can draw itself as three layers: everything
+    below the active sprite flattened onto the background, the active
+    sprite itself, and everything above it flattened together.
+
+    The flattened layers are only redrawn when the sprites in the group,
+    their order, or the image or position of a sprite other than the
+    active one changes, so moving or transforming the active sprite
+    costs the same however many sprites there are. Sprites report their
+    own changes through ImageSprite.changed().
+
+    The upper layer is kept premultiplied, so translucent edges that
+    overlap within it blend the same as they would drawn one by one.
+    """
+
+    def __init__(self, *sprites):
+        # Adding the sprites below already marks the layers out of date.
+        self.layer_key = None
+        self.layers_changed = True
+        self.below = None
+        self.above = None
+        super(FlattenedOrderedUpdates, self).__init__(*sprites)
+
+    def add_internal(self, sprite, layer=None):
+        super(FlattenedOrderedUpdates, self).add_internal(sprite, layer)
+        self.layers_changed = True
+
+    def remove_internal(self, sprite):
+        super(FlattenedOrderedUpdates, self).remove_internal(sprite)
+        self.layers_changed = True
+
+    def sprite_changed(self, sprite):
+        # The active sprite is drawn on its own every frame anyway.
+        if self.layer_key is None or sprite is not self.layer_key[2]:
+            self.layers_changed = True
+
+    def flatten(self, size, active, background):
+        # Imported here so the main menu doesn't load it at startup.
+        from compositing import premultiplied
+
+        sprites = self.sprites()
+        index = sprites.index(active) if active in sprites else len(sprites)
+
+        # The background is opaque, so the lower layer needs no alpha
+        # and copies straight onto the surface.
+        self.below = pygame.Surface(size, 0, 32)
+        self.below.fill(background)
+        for sprite in sprites[:index]:
+            self.below.blit(sprite.image, sprite.rect)
+
+        # The upper layer only covers the area its sprites take up.
+        self.above = None
+        above_sprites = sprites[index + 1:]
+        if above_sprites:
+            area = above_sprites[0].rect.unionall([sprite.rect for sprite in above_sprites])
+            area = area.clip(pygame.Rect((0, 0), size))
+            if area.w and area.h:
+                self.above = pygame.Surface(area.size, pygame.SRCALPHA, 32)
+                self.above_pos = area.topleft
+                for sprite in above_sprites:
+                    self.above.blit(premultiplied(sprite.image), sprite.rect.move(-area.x, -area.y),
+                                    special_flags=pygame.BLEND_PREMULTIPLIED)
+
+    def draw_flattened(self, surface, active, background):
+        """Fills 'surface' with 'background' and draws the group on top,
+        rebuilding the cached layers around 'active' if needed.
+        """
+        layer_key = (surface.get_size(), background, active)
+        if self.layers_changed or layer_key != self.layer_key:
+            self.flatten(layer_key[0], active, background)
+            self.layer_key = layer_key
+            self.layers_changed = False
+
+        surface.blit(self.below, (0, 0))
+        if active in self:
+            surface.blit(active.image, active.rect)
+        if self.above:
+            surface.blit(self.above, self.above_pos, special_flags=pygame.BLEND_PREMULTIPLIED)
+
+
 class ThumbnailSprite(ImageSprite):
     """Make thumbnails not draggable and small.
     """
 
-    def __init__(self, x, y, img_name, w, h):
+    def __init__(self, x, y, img_name, w, h, background=False):
 
         self.w = w
         self.h = h
 
+        # Made on a worker thread rather than straight away.
+        self.background = background
+
         super(ThumbnailSprite, self).__init__(x, y, img_name)
 
         self.is_draggable = False
 
     def init_image(self):
-        # Load the image from file and scale it to thumbnail size.
-        loaded_img = pygame.image.load(self.img_name)
-        size = loaded_img.get_size()
-
-        # Create a surface containing the image with a transparent
-        # background.
-        self.image = pygame.Surface(size, pygame.SRCALPHA, 32)
-
-        self.image.blit(loaded_img, (0, 0))
+        # Load the trimmed image and scale it to thumbnail size.
+        if self.background:
+            self.fit_image_later(self.img_name, (self.w, self.h))
+        else:
+            self.image = fitted_image(self.img_name, (self.w, self.h))
 
-        self.image = aspect_scale(self.image, (self.w, self.h))
+        # Thumbnails are fitted to their box, so the trim offset no
+        # longer applies.
+        self.trim_offset = (0, 0)
 
 
 class InputBox(object):
@@ -409,7 +691,6 @@ class InputBox(object):
         self.max_width =max_width
         self.active = False
         self.highlightrect = pygame.Rect(x -2, y-2, w+4, h+4)
-        self.framecount = 1
 
         self.adjust()
 
@@ -445,19 +726,13 @@ class InputBox(object):
         self.adjust()    
 
     def draw_input_box(self, game_state):
-        fps = game_state.get('fps')
         game_surface = game_state.get('game_surface') 
         game_surface.blit(self.txt_surface, (self.center_x+5 - (self.txt_surface.get_width()/2), self.rect.y+5))
         pygame.draw.rect(game_surface, self.colour, self.rect, 2)
         if self.active == True:
             pygame.draw.rect(game_surface, self.highlight_colour, self.highlightrect, 2)
-            if self.framecount <= (fps/2):
-                self.framecount += 1
-            if self.framecount < fps and self.framecount > (fps/2):
-                self.framecount += 1
+            if blink_on():
                 pygame.draw.line(game_surface,self.highlight_colour, (self.center_x +5 +(self.txt_surface.get_width()/2), self.rect.y +5), (self.center_x +5 +(self.txt_surface.get_width()/2), self.rect.y -5 +self.rect.h))
-            if self.framecount >= fps:
-                self.framecount =1
         
     def toggle_active(self):
         if self.active == False:
@@ -535,6 +810,10 @@ class ConfirmBox(object):
             n=0
             while n !=1:
                 for event in pygame.event.get():
+                    if event.type == JOB_DONE:
+                        finish_job(event)
+                    if event.type == WORK_DONE:
+                        finish_work(event)
                     if event.type == pygame.MOUSEBUTTONDOWN:
                         b = button_at_point(self.buttons, event.pos)
                         if b:
@@ -0,0 +1,45 @@
+import time
+
+"""This module times how long the game takes to start, from the moment
+spork.py begins running to the first frame of the main menu being shown.
+
+Import it before anything else so the clock starts as early as possible.
+Marks are always recorded, they're only printed when asked for with
+--startup-report.
+"""
+
+START = time.perf_counter()
+
+# (label, seconds since START) in the order they happened.
+marks = []
+
+# Print the report once the first frame is up.
+report_enabled = False
+
+# Anything slower than this to the first frame gets flagged in the report.
+TARGET_MS = 300
+
+
+def mark(label):
+    marks.append((label, time.perf_counter() - START))
+
+def first_frame():
+    """Called after every main menu frame, only the first one counts.
+    """
+    if any(label == 'first frame' for label, _ in marks):
+        return
+
+    mark('first frame')
+    if report_enabled:
+        report()
+
+def report():
+    print('Startup timings:')
+    previous = 0.0
+    for label, seconds in marks:
+        print('  {0:<22} {1:7.1f} ms  (+{2:.1f} ms)'.format(label, seconds * 1000, (seconds - previous) * 1000))
+        previous = seconds
+
+    total_ms = previous * 1000
+    if total_ms > TARGET_MS:
+        print('  over the {0} ms target by {1:.1f} ms'.format(TARGET_MS, total_ms - TARGET_MS))
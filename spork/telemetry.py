@@ -0,0 +1,295 @@
+import os, sys, json, time, threading, argparse
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, memory just isn't reported there.
+    resource = None
+
+"""This module records how the game performs during a session, for
+playtest machines where the numbers are looked at afterwards.
+
+It is off unless spork.py is started with --telemetry DIR. While on it
+keeps per-screen histograms of frame times, and the durations of asset
+loads, screen transitions, splices and crops, in buffers allocated up
+front. A background thread writes them to DIR/telemetry.jsonl every few
+seconds, along with the memory high-water mark, so the render loop never
+waits on the disk. The file is rotated as it grows.
+
+Run this module with 'report DIR' for a summary across every session
+recorded there.
+"""
+
+FILE_NAME = 'telemetry.jsonl'
+
+# Rotate the file past this size, keeping this many old ones.
+MAX_FILE_BYTES = 1024 * 1024
+MAX_OLD_FILES = 4
+
+FLUSH_SECONDS = 5.0
+
+# Timings kept between flushes, more than this and the oldest are lost.
+RING_SIZE = 4096
+
+# Upper edges of the frame time histogram buckets in ms, the last bucket
+# holds everything slower.
+FRAME_BUCKETS_MS = (2, 4, 8, 16.7, 33.3, 50, 100, 250)
+
+# The running recorder, None while telemetry is off.
+recorder = None
+
+
+def frame_bucket(ms):
+    for i, edge in enumerate(FRAME_BUCKETS_MS):
+        if ms <= edge:
+            return i
+    return len(FRAME_BUCKETS_MS)
+
+def peak_memory_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+class TelemetryRecorder(object):
+    """Collects timings on the render thread and writes them from a
+    background thread.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, FILE_NAME)
+        self.session = '{0}-{1}'.format(int(time.time()), os.getpid())
+
+        # Guards the ring and the frame histograms. Loads also finish on
+        # worker threads, and the writer thread copies both out.
+        self.lock = threading.Lock()
+
+        self.ring = [None] * RING_SIZE
+        self.written = 0
+        self.flushed = 0
+
+        # Frame histograms per screen, as [count, total ms, max ms, buckets]
+        # lists. Each flush writes what was added since the last one.
+        self.frames = {}
+        self.frames_flushed = {}
+        self.screen = None
+        self.switched = None
+
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='telemetry')
+        self.thread.daemon = True
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.write_records([{'type': 'session', 'started': time.time()}])
+        self.thread.start()
+
+    def add(self, record):
+        with self.lock:
+            self.ring[self.written % RING_SIZE] = record
+            self.written += 1
+
+    def frame(self, ms):
+        with self.lock:
+            stats = self.frames.get(self.screen)
+            if stats is None:
+                stats = [0, 0.0, 0.0, [0] * (len(FRAME_BUCKETS_MS) + 1)]
+                self.frames[self.screen] = stats
+            stats[0] += 1
+            stats[1] += ms
+            stats[2] = max(stats[2], ms)
+            stats[3][frame_bucket(ms)] += 1
+
+        # The screen being left finishes its frame first, wait for the
+        # new one.
+        if self.switched and self.switched[0] == self.screen:
+            screen, started = self.switched
+            self.switched = None
+            self.add(('transition', screen, (time.perf_counter() - started) * 1000))
+
+    def take_records(self):
+        # Copy everything out at once, then build the records without
+        # holding up the render thread.
+        with self.lock:
+            written = self.written
+            lost = max(written - self.flushed - RING_SIZE, 0)
+            timings = [self.ring[i % RING_SIZE] for i in range(self.flushed + lost, written)]
+            frames = [(screen, stats[0], stats[1], stats[2], list(stats[3])) for screen, stats in self.frames.items()]
+            screen_shown = self.screen
+            self.flushed = written
+
+        records = [{'type': 'timing', 'kind': kind, 'name': name, 'ms': round(ms, 3)} for kind, name, ms in timings]
+        if lost:
+            records.append({'type': 'lost', 'count': lost})
+
+        for screen, count, total, worst, buckets in frames:
+            last = self.frames_flushed.get(screen, [0, 0.0, [0] * len(buckets)])
+            if count == last[0]:
+                continue
+            records.append({
+                'type': 'frames',
+                'screen': screen,
+                'count': count - last[0],
+                'total_ms': round(total - last[1], 3),
+                'max_ms': round(worst, 3),
+                'buckets': [b - a for a, b in zip(last[2], buckets)],
+            })
+            self.frames_flushed[screen] = [count, total, buckets]
+
+        records.append({'type': 'memory', 'screen': screen_shown, 'peak_kb': peak_memory_kb()})
+        return records
+
+    def write_records(self, records):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > MAX_FILE_BYTES:
+            self.rotate()
+        with open(self.path, 'a') as f:
+            for record in records:
+                record['session'] = self.session
+                record['t'] = round(time.time(), 3)
+                f.write(json.dumps(record) + '\n')
+
+    def rotate(self):
+        for i in range(MAX_OLD_FILES - 1, 0, -1):
+            older = '{0}.{1}'.format(self.path, i)
+            if os.path.exists(older):
+                os.replace(older, '{0}.{1}'.format(self.path, i + 1))
+        os.replace(self.path, self.path + '.1')
+
+    def flush(self):
+        self.write_records(self.take_records())
+
+    def run(self):
+        while not self.stopping.wait(FLUSH_SECONDS):
+            self.flush()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.flush()
+
+
+def start(directory):
+    global recorder
+    recorder = TelemetryRecorder(directory)
+    recorder.start()
+
+def stop():
+    global recorder
+    if recorder:
+        recorder.stop()
+        recorder = None
+
+def frame(ms):
+    """Records how long the frame just finished took to make.
+    """
+    if recorder:
+        recorder.frame(ms)
+
+def timing(kind, name, ms):
+    if recorder:
+        recorder.add((kind, name, ms))
+
+@contextmanager
+def timed(kind, name):
+    """Times the body of a with block as a 'kind' timing.
+    """
+    if not recorder:
+        yield
+        return
+    started = time.perf_counter()
+    yield
+    timing(kind, name, (time.perf_counter() - started) * 1000)
+
+def screen_switched(name):
+    """Starts timing a transition, it ends with the next frame drawn.
+    """
+    if recorder:
+        recorder.switched = (name, time.perf_counter())
+
+def screen_shown(name):
+    if recorder:
+        recorder.screen = name
+
+
+def read_records(directory):
+    paths = [os.path.join(directory, FILE_NAME + '.' + str(i)) for i in range(MAX_OLD_FILES, 0, -1)]
+    paths.append(os.path.join(directory, FILE_NAME))
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A line cut short by the game being killed.
+                    pass
+
+def bucket_percentile(buckets, fraction):
+    """Upper edge of the bucket holding the given fraction of frames.
+    """
+    target = sum(buckets) * fraction
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= target and count:
+            return FRAME_BUCKETS_MS[i] if i < len(FRAME_BUCKETS_MS) else float('inf')
+    return 0
+
+def report(directory):
+    sessions = set()
+    frames = {}
+    timings = {}
+    peak_kb = 0
+    lost = 0
+
+    for record in read_records(directory):
+        sessions.add(record.get('session'))
+        kind = record.get('type')
+        if kind == 'frames':
+            stats = frames.setdefault(record.get('screen'), [0, 0.0, 0.0, [0] * (len(FRAME_BUCKETS_MS) + 1)])
+            stats[0] += record.get('count')
+            stats[1] += record.get('total_ms')
+            stats[2] = max(stats[2], record.get('max_ms'))
+            stats[3] = [a + b for a, b in zip(stats[3], record.get('buckets'))]
+        elif kind == 'timing':
+            timings.setdefault(record.get('kind'), []).append(record.get('ms'))
+        elif kind == 'memory':
+            peak_kb = max(peak_kb, record.get('peak_kb') or 0)
+        elif kind == 'lost':
+            lost += record.get('count')
+
+    print('{0} sessions in {1}'.format(len(sessions), directory))
+
+    print('\nFrame times (ms)')
+    print('  {0:<18} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}'.format('screen', 'frames', 'mean', 'p50 <=', 'p95 <=', 'max'))
+    for screen, (count, total, worst, buckets) in sorted(frames.items(), key=lambda item: str(item[0])):
+        print('  {0:<18} {1:>8} {2:>8.2f} {3:>8} {4:>8} {5:>8.2f}'.format(
+            str(screen), count, total / count, bucket_percentile(buckets, 0.5), bucket_percentile(buckets, 0.95), worst))
+
+    print('\nTimings (ms)')
+    print('  {0:<18} {1:>8} {2:>8} {3:>8} {4:>8}'.format('kind', 'count', 'mean', 'p95', 'max'))
+    for kind, values in sorted(timings.items()):
+        values.sort()
+        p95 = values[min(int(len(values) * 0.95), len(values) - 1)]
+        print('  {0:<18} {1:>8} {2:>8.2f} {3:>8.2f} {4:>8.2f}'.format(kind, len(values), sum(values) / len(values), p95, values[-1]))
+
+    if peak_kb:
+        print('\nPeak memory: {0:.1f} MB'.format(peak_kb / 1024.0))
+    if lost:
+        print('{0} timings were lost to a full buffer.'.format(lost))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Summarise Spork telemetry.')
+    parser.add_argument('command', choices=['report'])
+    parser.add_argument('directory', nargs='?', default=os.path.join(os.getcwd(), 'data', 'telemetry'))
+    args = parser.parse_args()
+    report(args.directory)